@@ -0,0 +1,83 @@
+"""
+Benchmark comparing struct decoding against the original (per-field format string) implementation.
+"""
+from __future__ import print_function
+import sys
+import struct
+import timeit
+import optparse
+
+from keepassdb import const, exc
+from keepassdb.structs import EntryStruct
+
+def legacy_decode(self, buf):
+    """ The original StructBase.decode() loop (slicing + two unpack calls per field). """
+    index = 0
+    while True:
+        substr = buf[index:index + 6]
+        index += 6
+        if index > len(buf):
+            raise ValueError("Group header offset is out of range: {0}".format(index))
+        (typ, siz) = struct.unpack('<H L', substr)
+        self.order.append((typ, siz))
+
+        substr = buf[index:index + siz]
+        index += siz
+        encoded = struct.unpack('<%ds' % siz, substr)[0]
+
+        (name, marshall) = self.format[typ]
+        if name is None:
+            break
+        try:
+            value = marshall.decode(encoded)
+            self.log.debug("Decoded field [{0}] to value {1!r}".format(name, value))
+        except struct.error as msg:
+            raise exc.ParseError(str(msg))
+        setattr(self, name, value)
+
+def make_entries(count):
+    buf = bytearray()
+    for i in range(count):
+        estruct = EntryStruct()
+        estruct.uuid = ('%032x' % i).encode('ascii')
+        estruct.group_id = 1
+        estruct.icon = 1
+        estruct.title = u'Entry {0}'.format(i)
+        estruct.url = u'http://example.com/{0}'.format(i)
+        estruct.username = u'user{0}'.format(i)
+        estruct.password = u'password{0}'.format(i)
+        estruct.notes = u'Some notes for entry {0}'.format(i)
+        estruct.created = estruct.modified = estruct.accessed = const.NEVER
+        estruct.expires = const.NEVER
+        estruct.binary_desc = u''
+        estruct.binary = b''
+        buf += estruct.encode()
+    return bytes(buf)
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser("usage: %prog [-n ENTRIES] [-r REPEAT]")
+    parser.add_option('-n', '--entries', type='int', default=10000, help="Number of entries to decode.")
+    parser.add_option('-r', '--repeat', type='int', default=3, help="Number of timing repetitions.")
+    (opts, args) = parser.parse_args(sys.argv)
+
+    buf = make_entries(opts.entries)
+
+    def run_legacy():
+        rest = buf
+        for _i in range(opts.entries):
+            estruct = EntryStruct()
+            legacy_decode(estruct, rest)
+            rest = rest[len(estruct):]
+
+    def run_current():
+        offset = 0
+        for _i in range(opts.entries):
+            offset = EntryStruct().decode(buf, offset)
+
+    legacy = min(timeit.repeat(run_legacy, number=1, repeat=opts.repeat))
+    current = min(timeit.repeat(run_current, number=1, repeat=opts.repeat))
+
+    print("Decoding {0} entries ({1} bytes)".format(opts.entries, len(buf)))
+    print("  legacy:  {0:.3f}s ({1:.1f} us/entry)".format(legacy, legacy * 1e6 / opts.entries))
+    print("  current: {0:.3f}s ({1:.1f} us/entry)".format(current, current * 1e6 / opts.entries))
+    print("  speedup: {0:.2f}x".format(legacy / current))
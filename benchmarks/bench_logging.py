@@ -0,0 +1,58 @@
+"""
+Benchmark of save/load throughput with (debug) logging disabled and enabled.
+"""
+from __future__ import print_function
+import sys
+import logging
+import timeit
+import optparse
+from io import BytesIO
+
+from keepassdb import Database
+
+class NullStream(object):
+    """ Discards the log output (so that only formatting/dispatch is measured). """
+    def write(self, data):
+        pass
+    def flush(self):
+        pass
+
+def make_database(count):
+    db = Database()
+    group = db.create_default_group()
+    db.create_entries(group, [dict(title=u'Entry {0}'.format(i), url=u'http://example.com/{0}'.format(i),
+                                   username=u'user{0}'.format(i), password=u'password{0}'.format(i),
+                                   notes=u'Some notes for entry {0}'.format(i))
+                              for i in range(count)])
+    return db
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser("usage: %prog [-n ENTRIES] [-r REPEAT]")
+    parser.add_option('-n', '--entries', type='int', default=10000, help="Number of entries in the database.")
+    parser.add_option('-r', '--repeat', type='int', default=3, help="Number of timing repetitions.")
+    (opts, args) = parser.parse_args(sys.argv)
+    
+    db = make_database(opts.entries)
+    # Don't reuse encoded bytes, so that every save serializes all entries.
+    db.cache_encoded = False
+    stream = BytesIO()
+    db.save(dbfile=stream, password='test')
+    data = stream.getvalue()
+    
+    def run_save():
+        db.save(dbfile=BytesIO(), password='test')
+    
+    def run_load():
+        Database().load_from_buffer(data, password='test')
+    
+    log = logging.getLogger('keepassdb')
+    log.addHandler(logging.StreamHandler(NullStream()))
+    log.propagate = False
+    
+    print("Saving/loading {0} entries ({1} bytes)".format(opts.entries, len(data)))
+    for (label, level) in (('disabled', logging.WARNING), ('enabled', logging.DEBUG)):
+        log.setLevel(level)
+        save = min(timeit.repeat(run_save, number=1, repeat=opts.repeat))
+        load = min(timeit.repeat(run_load, number=1, repeat=opts.repeat))
+        print("  logging {0:<8}: save {1:.3f}s ({2:.0f} entries/s), load {3:.3f}s ({4:.0f} entries/s)".format(
+            label, save, opts.entries / save, load, opts.entries / load))
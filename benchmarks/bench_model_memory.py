@@ -0,0 +1,55 @@
+"""
+Benchmark comparing the memory used per entry by the regular and compact (__slots__) model classes.
+"""
+from __future__ import print_function
+import sys
+import gc
+import optparse
+
+from keepassdb import const
+from keepassdb.model import Entry, CompactEntry
+
+try:
+    import tracemalloc
+except ImportError: # Python < 3.4
+    tracemalloc = None
+
+def make_entries(cls, count):
+    return [cls(uuid=('%032x' % i).encode('ascii'), group_id=1, icon=1,
+                title=u'Entry', url=u'http://example.com', username=u'user', password=u'password',
+                notes=u'', created=const.NEVER, modified=const.NEVER, accessed=const.NEVER,
+                expires=const.NEVER, binary_desc=u'', binary=b'')
+            for i in range(count)]
+
+def instance_size(obj):
+    """ The size of the object itself (and its attribute dict, if any), excluding attribute values. """
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+def traced_size(cls, count):
+    """ The total memory allocated for creating the entries (Python 3.4+ only). """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        entries = make_entries(cls, count)
+        (current, _peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del entries
+    return current
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser("usage: %prog [-n ENTRIES]")
+    parser.add_option('-n', '--entries', type='int', default=100000, help="Number of entries to create.")
+    (opts, args) = parser.parse_args(sys.argv)
+
+    print("Memory per entry ({0} entries)".format(opts.entries))
+    for cls in (Entry, CompactEntry):
+        entry = make_entries(cls, 1)[0]
+        line = "  {0:<13} instance: {1:5d} bytes".format(cls.__name__, instance_size(entry))
+        if tracemalloc is not None:
+            total = traced_size(cls, opts.entries)
+            line += ", total allocated: {0:7.1f} bytes".format(float(total) / opts.entries)
+        print(line)
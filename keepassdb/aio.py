@@ -0,0 +1,155 @@
+"""
+An asyncio interface for loading and saving databases (Python 3.5+ only).
+
+Key derivation, decryption/encryption and file I/O are run in an executor, so they
+do not block the event loop.  The number of concurrent loads/saves can be limited with
+a semaphore and each operation can be given a timeout.
+
+Note that a cancelled (or timed out) operation only stops waiting for the executor; the
+work that is already running in the executor thread is not interrupted.  A cancelled
+load leaves the wrapped database unchanged (the file is loaded into a new database with
+the same settings, which replaces it on success).
+"""
+__authors__ = ["Hans Lellelid <hans@xmpl.org>"]
+__license__ = """
+keepassdb is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or at your option) any later version.
+
+keepassdb is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+keepassdb.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import asyncio
+import functools
+import os.path
+
+from keepassdb.db import Database
+
+def _read_file(path):
+    if not os.path.exists(path):
+        raise IOError("File does not exist: {0}".format(path))
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+class AsyncDatabase(object):
+    """
+    Wraps a :class:`keepassdb.db.Database` with coroutines for loading and saving.
+
+    :ivar db: The wrapped database.
+    :ivar semaphore: Optional :class:`asyncio.Semaphore` limiting the number of concurrent
+                     loads/saves; shared by all instances if set on the class.
+    :ivar timeout: Default timeout (in seconds) for loads/saves (None for no timeout).
+    :ivar executor: The executor to run the blocking work in (None for the loop's default executor).
+    """
+    semaphore = None
+    timeout = None
+    executor = None
+
+    def __init__(self, db=None, semaphore=None, timeout=None, executor=None):
+        """
+        :param db: The database to wrap (a new :class:`keepassdb.db.Database` if not specified).
+        :type db: :class:`keepassdb.db.Database`
+        :param semaphore: Semaphore limiting concurrent loads/saves.
+        :type semaphore: :class:`asyncio.Semaphore`
+        :param timeout: Default timeout (in seconds).
+        :type timeout: float
+        :param executor: The executor for the blocking work.
+        :type executor: :class:`concurrent.futures.Executor`
+        """
+        if db is None:
+            db = Database()
+        self.db = db
+        if semaphore is not None:
+            self.semaphore = semaphore
+        if timeout is not None:
+            self.timeout = timeout
+        if executor is not None:
+            self.executor = executor
+
+    async def _run(self, func, *args, **kwargs):
+        """ Runs blocking function in the executor. """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _limit(self, func, *args):
+        if self.semaphore is None:
+            return await func(*args)
+        async with self.semaphore:
+            return await func(*args)
+
+    async def _call(self, timeout, func, *args):
+        """ Runs the coroutine function with the semaphore (if any) and timeout (which includes waiting for the semaphore). """
+        if timeout is None:
+            timeout = self.timeout
+        return await asyncio.wait_for(self._limit(func, *args), timeout)
+
+    async def aload(self, dbfile, password=None, keyfile=None, readonly=False, timeout=None):
+        """
+        Load the database from file/stream (see :meth:`keepassdb.db.Database.load`).
+
+        :param timeout: Timeout in seconds (default: :attr:`timeout`).
+        :type timeout: float
+        :returns: The loaded database (also available as :attr:`db`).
+        :rtype: :class:`keepassdb.db.Database`
+        :raises: :class:`asyncio.TimeoutError` - If the load did not finish in time.
+        """
+        return await self._call(timeout, self._load, dbfile, password, keyfile, readonly)
+
+    async def _load(self, dbfile, password, keyfile, readonly):
+        if hasattr(dbfile, 'read'):
+            buf = await self._run(dbfile.read)
+        else:
+            buf = await self._run(_read_file, dbfile)
+
+        # Load into a new database (with the same settings), so that the wrapped
+        # database is left alone if the load fails or is cancelled.
+        db = type(self.db)()
+        for name in Database._settings:
+            setattr(db, name, getattr(self.db, name))
+        await self._run(db.load_from_buffer, buf, password=password, keyfile=keyfile, readonly=readonly)
+        db.readonly = readonly
+        if not hasattr(dbfile, 'read'):
+            locked = getattr(self.db, '_locked', False)
+            if locked and self.db.filepath == dbfile and not readonly:
+                # Take over the lock of the wrapped (LockingDatabase) database on the same file.
+                db._filepath = dbfile
+                db._locked = True
+                self.db._locked = False
+            else:
+                # (Takes out the lock on the new file for a LockingDatabase.)
+                db.filepath = dbfile
+                if locked:
+                    self.db.filepath = None
+        self.db = db
+        return db
+
+    async def asave(self, dbfile=None, password=None, keyfile=None, timeout=None):
+        """
+        Save the database to specified file/stream (see :meth:`keepassdb.db.Database.save`).
+
+        :param timeout: Timeout in seconds (default: :attr:`timeout`).
+        :type timeout: float
+        :raises: :class:`asyncio.TimeoutError` - If the save did not finish in time.
+        """
+        return await self._call(timeout, self._save, dbfile, password, keyfile)
+
+    async def _save(self, dbfile, password, keyfile):
+        # A single save in the executor, which only replaces the header and resets the
+        # dirty flags once the file/stream has been written.
+        await self._run(self.db.save, dbfile, password=password, keyfile=keyfile)
+
+async def aopen(dbfile, password=None, keyfile=None, readonly=False, **kwargs):
+    """
+    Loads a database (see :meth:`AsyncDatabase.aload`).
+
+    Other keyword arguments are passed to :class:`AsyncDatabase`.
+
+    :rtype: :class:`AsyncDatabase`
+    """
+    adb = AsyncDatabase(**kwargs)
+    await adb.aload(dbfile, password=password, keyfile=keyfile, readonly=readonly)
+    return adb
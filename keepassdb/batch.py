@@ -0,0 +1,190 @@
+"""
+Opening and saving many databases in parallel (in a pool of worker processes).
+
+Key derivation and parsing are CPU-bound Python code, so threads would be serialized by the
+GIL; these functions do the work in separate processes instead.  The workers return the
+parsed groups/entries as plain (picklable) records, which are used to rebuild the
+:class:`keepassdb.db.Database` objects in the calling process.
+
+Passwords (and keyfiles) are passed to the worker processes, so keyfiles must be paths
+rather than streams.
+"""
+__authors__ = ["Hans Lellelid <hans@xmpl.org>"]
+__license__ = """
+keepassdb is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or at your option) any later version.
+
+keepassdb is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+keepassdb.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import multiprocessing
+
+from Crypto import Random
+
+from keepassdb import exc
+from keepassdb.db import Database
+from keepassdb.structs import HeaderStruct, GroupStruct, EntryStruct
+
+# The model attributes that make up the group/entry records (same as the struct attributes).
+GROUP_ATTRIBUTES = sorted(GroupStruct().attributes())
+ENTRY_ATTRIBUTES = sorted(EntryStruct().attributes())
+
+def dump(db):
+    """
+    Returns a picklable record of the database contents (see :func:`restore`).
+
+    :type db: :class:`keepassdb.db.Database`
+    :rtype: dict
+    """
+    groups = [(dict((name, getattr(g, name)) for name in GROUP_ATTRIBUTES), g._encoded if not g.dirty else None)
+              for g in db.groups]
+    entries = [(dict((name, getattr(e, name)) for name in ENTRY_ATTRIBUTES), e._encoded if not e.dirty else None)
+               for e in db.entries]
+    return dict(header=db.header.encode() if db.header is not None else None,
+                groups=groups, entries=entries)
+
+def restore(record, db=None):
+    """
+    Populates a database from a record returned by :func:`dump`.
+
+    :param record: The database record.
+    :type record: dict
+    :param db: The database to populate (a new :class:`keepassdb.db.Database` if not specified).
+    :type db: :class:`keepassdb.db.Database`
+    :rtype: :class:`keepassdb.db.Database`
+    """
+    if db is None:
+        db = Database()
+    else:
+        db._clear()
+    if record['header'] is not None:
+        db.header = HeaderStruct(record['header'])
+    for (attrs, encoded) in record['groups']:
+        group = db.group_class(**attrs)
+        if db.cache_encoded:
+            group._encoded = encoded
+        db.groups.append(group)
+    for (attrs, encoded) in record['entries']:
+        entry = db.entry_class(**attrs)
+        if db.cache_encoded:
+            entry._encoded = encoded
+        db.entries.append(entry)
+    if db.groups:
+        db._bind_model()
+    return db
+
+def _open_worker(args):
+    """ Loads a database (in the worker process) and returns its record or the exception. """
+    (path, password, keyfile) = args
+    try:
+        db = Database(path, password=password, keyfile=keyfile, readonly=True)
+        return dump(db)
+    except Exception as e:
+        return e
+
+def _save_worker(args):
+    """ Restores and saves a database (in the worker process) and returns the new header or the exception. """
+    (record, path, password, keyfile, rounds) = args
+    try:
+        db = restore(record)
+        db.save_rounds = rounds
+        db.save(path, password=password, keyfile=keyfile)
+        return db.header.encode()
+    except Exception as e:
+        return e
+
+def _init_worker():
+    """ The (PyCrypto) random number generator must be re-initialized in forked processes. """
+    atfork = getattr(Random, 'atfork', None)
+    if atfork is not None:
+        atfork()
+
+def _map(func, args, processes):
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    try:
+        return pool.map(func, args, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+def open_databases(items, processes=None, raise_errors=True):
+    """
+    Opens many databases in parallel.
+
+    :param items: The databases to open.
+    :type items: iterable of (path, password, keyfile) tuples
+    :param processes: The number of worker processes (default: number of CPUs).
+    :type processes: int
+    :param raise_errors: Whether to raise the first error; otherwise the exception is returned
+                         in place of the database that could not be opened.
+    :type raise_errors: bool
+    :returns: The :class:`keepassdb.db.Database` objects (in the same order as items).
+    :rtype: list
+    """
+    items = [tuple(item) for item in items]
+    results = []
+    for ((path, password, keyfile), record) in zip(items, _map(_open_worker, items, processes)):
+        if isinstance(record, Exception):
+            if raise_errors:
+                raise record
+            results.append(record)
+            continue
+        db = restore(record)
+        db.password = password
+        db.keyfile = keyfile
+        db.filepath = path
+        results.append(db)
+    return results
+
+def save_databases(items, processes=None, raise_errors=True):
+    """
+    Saves many databases in parallel.
+
+    :param items: The databases to save; path, password and keyfile default to the database's
+                  filepath, password and keyfile if None.
+    :type items: iterable of (database, path, password, keyfile) tuples
+    :param processes: The number of worker processes (default: number of CPUs).
+    :type processes: int
+    :param raise_errors: Whether to raise the first error; otherwise the exceptions are returned
+                         (None for the databases that were saved).
+    :type raise_errors: bool
+    :returns: List of None or exception for each database (in the same order as items).
+    :rtype: list
+    """
+    items = [tuple(item) for item in items]
+    args = []
+    for (db, path, password, keyfile) in items:
+        if db.readonly:
+            raise exc.ReadOnlyDatabase()
+        if path is None:
+            path = db.filepath
+        if path is None or hasattr(path, 'write'):
+            raise ValueError("Databases can only be saved to a file path.")
+        if password is None and keyfile is None:
+            (password, keyfile) = (db.password, db.keyfile)
+        # (The save_rounds policy is resolved here, as the worker saves a default Database.)
+        args.append((dump(db), path, password, keyfile, db._save_rounds()))
+
+    results = []
+    for ((db, _, _, _), (_, path, password, keyfile, _), header) in zip(items, args, _map(_save_worker, args, processes)):
+        if isinstance(header, Exception):
+            if raise_errors:
+                raise header
+            results.append(header)
+            continue
+        db.header = HeaderStruct(header)
+        db.filepath = path
+        db.password = password
+        db.keyfile = keyfile
+        # (Changed records were encoded in the worker, so their cached bytes are outdated.)
+        for obj in db.groups + db.entries:
+            if obj.dirty:
+                obj._encoded = None
+        db._mark_clean()
+        results.append(None)
+    return results
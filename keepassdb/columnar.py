@@ -0,0 +1,223 @@
+"""
+A column-oriented, read-only view of the entries in one or more databases, intended for
+audits (password age, expiry, duplicates, ...) over large numbers of entries.
+
+Numeric attributes are kept in compact :mod:`array` columns; timestamps are stored as
+seconds since the epoch and string attributes as indexes into a single interned string
+pool (so equal strings, e.g. reused passwords, share the same index).  Filters are
+evaluated column by column and return row numbers.
+"""
+__authors__ = ["Hans Lellelid <hans@xmpl.org>"]
+__license__ = """
+keepassdb is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or at your option) any later version.
+
+keepassdb is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+keepassdb.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import calendar
+from array import array
+from itertools import compress
+
+from keepassdb import const
+
+def timestamp(dt):
+    """
+    Converts a (naive) datetime to the seconds-since-epoch value stored in the date columns.
+
+    :type dt: :class:`datetime.datetime`
+    :rtype: float
+    """
+    return float(calendar.timegm(dt.timetuple()))
+
+# The timestamp of the special "never expires" date.
+NEVER = timestamp(const.NEVER)
+
+class EntryColumns(object):
+    """
+    Column-oriented snapshot of the entries of one or more databases.
+
+    The view is not updated when the databases change.
+
+    :ivar databases: The list of databases the entries were read from.
+    :ivar strings: The interned string pool (string columns hold indexes into this list).
+    """
+
+    # Column name -> array typecode
+    numeric_columns = (
+        ('database', 'L'),
+        ('group_id', 'L'),
+        ('icon', 'L'),
+        ('created', 'd'),
+        ('modified', 'd'),
+        ('accessed', 'd'),
+        ('expires', 'd'),
+    )
+
+    string_columns = ('title', 'username', 'url', 'password')
+
+    date_columns = ('created', 'modified', 'accessed', 'expires')
+
+    def __init__(self, databases):
+        """
+        :param databases: The database(s) to read the entries from.
+        :type databases: :class:`keepassdb.db.Database` or list
+        """
+        if not isinstance(databases, (list, tuple)):
+            databases = [databases]
+        self.databases = list(databases)
+        self.strings = []
+        self._string_index = {}
+        self._columns = {}
+        for (name, typecode) in self.numeric_columns:
+            self._columns[name] = array(typecode)
+        for name in self.string_columns:
+            self._columns[name] = array('L')
+        self._entries = []
+
+        for (dbindex, db) in enumerate(self.databases):
+            for entry in db.entries:
+                self._append(dbindex, entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _intern(self, value):
+        if value is None:
+            value = u''
+        try:
+            return self._string_index[value]
+        except KeyError:
+            index = len(self.strings)
+            self.strings.append(value)
+            self._string_index[value] = index
+            return index
+
+    def _append(self, dbindex, entry):
+        columns = self._columns
+        columns['database'].append(dbindex)
+        columns['group_id'].append(entry.group_id)
+        columns['icon'].append(entry.icon)
+        for name in self.date_columns:
+            columns[name].append(timestamp(getattr(entry, name)))
+        for name in self.string_columns:
+            columns[name].append(self._intern(getattr(entry, name)))
+        self._entries.append(entry)
+
+    def column(self, name):
+        """
+        Returns the (array) column for specified attribute.
+
+        :rtype: :class:`array.array`
+        """
+        return self._columns[name]
+
+    def string_id(self, value):
+        """
+        Returns the string pool index for value (or None if no entry has that value).
+
+        :rtype: int
+        """
+        return self._string_index.get(value)
+
+    def filter(self, rows=None, **predicates):
+        """
+        Returns the rows for which all predicates are true.
+
+        Each keyword names a column and gives a function that is called with the column
+        values (timestamps for date columns, strings for string columns), e.g.::
+
+            cols.filter(expires=lambda t: t < timestamp(datetime.now()), username=lambda u: u == 'root')
+
+        :param rows: Optional rows to restrict the filter to (e.g. the result of another filter).
+        :type rows: list
+        :returns: Sorted list of matching row numbers.
+        :rtype: list
+        """
+        if rows is None:
+            selected = range(len(self))
+        else:
+            selected = list(rows)
+
+        for (name, predicate) in predicates.items():
+            values = self._columns[name]
+            if name in self.string_columns:
+                # Evaluate the predicate once per distinct string of the selected rows (only).
+                strings = self.strings
+                matches = {}
+                mask = []
+                for row in selected:
+                    index = values[row]
+                    try:
+                        match = matches[index]
+                    except KeyError:
+                        match = matches[index] = predicate(strings[index])
+                    mask.append(match)
+            else:
+                mask = [predicate(values[row]) for row in selected]
+            selected = list(compress(selected, mask))
+
+        return list(selected)
+
+    def expired(self, at):
+        """
+        Returns the rows of entries that expire before specified date.
+
+        :type at: :class:`datetime.datetime`
+        :rtype: list
+        """
+        limit = timestamp(at)
+        return self.filter(expires=lambda t: t < limit)
+
+    def older_than(self, at, column='modified'):
+        """
+        Returns the rows whose date column (default: modified) is before specified date.
+
+        :type at: :class:`datetime.datetime`
+        :rtype: list
+        """
+        limit = timestamp(at)
+        return self.filter(**{column: lambda t: t < limit})
+
+    def duplicates(self, column='password', ignore_empty=True):
+        """
+        Returns the groups of rows that share the same value in a string column.
+
+        :param column: The string column (default: password).
+        :param ignore_empty: Whether to skip empty values.
+        :returns: List of row lists (only values occurring more than once).
+        :rtype: list
+        """
+        empty = self._string_index.get(u'')
+        by_value = {}
+        for (row, value) in enumerate(self._columns[column]):
+            if ignore_empty and value == empty:
+                continue
+            by_value.setdefault(value, []).append(row)
+        return [rows for rows in by_value.values() if len(rows) > 1]
+
+    def values(self, column, rows=None):
+        """
+        Returns the values of a column (strings are resolved from the pool) for specified rows.
+
+        :rtype: list
+        """
+        values = self._columns[column]
+        if rows is None:
+            rows = range(len(self))
+        if column in self.string_columns:
+            return [self.strings[values[row]] for row in rows]
+        return [values[row] for row in rows]
+
+    def entries(self, rows):
+        """
+        Returns the entry objects for specified rows.
+
+        :rtype: list
+        """
+        return [self._entries[row] for row in rows]
@@ -30,4 +30,8 @@ DB_SIGNATURE2 = 0xB54BFB65
 DB_SUPPORTED_VERSION = 0x00030002 
 DB_SUPPORTED_VERSION_MASK = 0xFFFFFF00
 
-DB_MAX_CONTENT_LEN = 2147483446
\ No newline at end of file
+DB_MAX_CONTENT_LEN = 2147483446
+
+# Key transformation rounds for new databases (and the maximum that fits in the header)
+DB_DEFAULT_KEY_ENC_ROUNDS = 50000
+DB_MAX_KEY_ENC_ROUNDS = 0xFFFFFFFF
\ No newline at end of file
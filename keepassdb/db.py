@@ -8,12 +8,18 @@ import logging
 import os
 import os.path
 import hashlib
+import mmap
+import shutil
+import sys
+import tempfile
+import traceback
+from itertools import chain
 
 from Crypto.Random import get_random_bytes
 
 from keepassdb import exc, util, const
-from keepassdb.model import Group, Entry, RootGroup
-from keepassdb.structs import HeaderStruct, GroupStruct, EntryStruct
+from keepassdb.model import Group, Entry, LazyEntry, RootGroup
+from keepassdb.structs import HeaderStruct, GroupStruct, EntryStruct, record_end
 
 __authors__ = ["Karsten-Kai König <kkoenig@posteo.de>", "Hans Lellelid <hans@xmpl.org>", "Brett Viren <brett.viren@gmail.com>"]
 __license__ = """
@@ -41,15 +47,64 @@ class Database(object):
     :ivar password: The passphrase to use to encrypt the database.
     :ivar keyfile: A path to a keyfile that can be used instead or in combination with passphrase.
     :ivar header: The database header struct (:class:`keepassdb.structs.HeaderStruct`).
+    :ivar key_cache: Optional cache for derived keys (:class:`keepassdb.util.KeyCache`), shared
+                     by all instances if set on the class.
+    :ivar reuse_transform_seed: Whether to keep the transform seed (and transformed key) of the
+                                loaded database when saving (with the same password/keyfile), so that
+                                only the encryption IV and final key seed are regenerated.  Not used with
+                                keyfile streams.
+    :ivar reuse_group_ids: Whether ids of removed groups may be assigned to new groups (by default
+                           new groups always get an id above all ids used so far).
+    :ivar save_chunk_size: The (approximate) number of bytes serialized, hashed and encrypted at a time
+                           when saving.
+    :ivar lazy_entries: Whether entry fields (other than uuid and group_id) should only be decoded
+                        when first accessed (see :class:`keepassdb.model.LazyEntry`); this keeps the
+                        decrypted content in memory.  Does not apply to :meth:`iterload`; cannot be
+                        combined with a custom :attr:`entry_class`.
+    :ivar group_class: The class used for (loaded and new) groups, e.g. :class:`keepassdb.model.CompactGroup`
+                       to use less memory.
+    :ivar entry_class: The class used for (loaded and new) entries, e.g. :class:`keepassdb.model.CompactEntry`;
+                       loading with :attr:`lazy_entries` (which uses :class:`keepassdb.model.LazyEntry`)
+                       requires the default :class:`keepassdb.model.Entry`.
+    :ivar cache_encoded: Whether to keep the encoded bytes of each group/entry (as loaded or last saved)
+                         and reuse them when saving groups/entries that have not changed (i.e. are not
+                         dirty).
+    :ivar save_rounds: The number of key transformation rounds used when saving: 'preserve' (the rounds of
+                       the loaded/last saved database, or :data:`keepassdb.const.DB_DEFAULT_KEY_ENC_ROUNDS`
+                       for a new database), 'calibrate' (the rounds that take about :attr:`calibrate_seconds`
+                       on this host, see :func:`keepassdb.util.calibrate_rounds`) or a fixed number.
+    :ivar calibrate_seconds: The target key transformation time (in seconds) for the 'calibrate' policy.
     """
     root = None
     groups = None # The flat list of :class:`keepassdb.model.Group` groups in this database.
     entries = None
     
+    _groups_by_id = None # Index of groups by id (see get_group())
+    _entries_by_uuid = None # Index of entries by uuid (see get_entry())
+    _group_ids = None # The :class:`keepassdb.util.IdAllocator` for new groups
+    _created = None # The groups/entries created since load/save (see changes())
+    _removed = None # The loaded/saved groups/entries removed since (see changes())
+    
     readonly = False
     header = None
     password = None
     keyfile = None
+    key_cache = None
+    reuse_transform_seed = False
+    reuse_group_ids = False
+    save_chunk_size = 65536
+    lazy_entries = False
+    group_class = Group
+    entry_class = Entry
+    cache_encoded = True
+    save_rounds = 'preserve'
+    calibrate_seconds = 1.0
+    _calibrated_rounds = {} # (Shared) cache of calibrated rounds by target time
+    
+    # The (instance) settings above, e.g. to configure a new instance the same way.
+    _settings = ('key_cache', 'reuse_transform_seed', 'reuse_group_ids', 'save_chunk_size', 'lazy_entries',
+                 'group_class', 'entry_class', 'cache_encoded', 'save_rounds', 'calibrate_seconds')
+    _transform = None
     _filepath = None
     
     def __init__(self, dbfile=None, password=None, keyfile=None, readonly=False, new=False):
@@ -77,6 +132,11 @@ class Database(object):
         self.root = RootGroup()
         self.groups = []
         self.entries = []
+        self._groups_by_id = {}
+        self._entries_by_uuid = {}
+        self._group_ids = util.IdAllocator()
+        self._created = set()
+        self._removed = []
         
         if new:
             if hasattr(dbfile, 'read'):
@@ -92,10 +152,16 @@ class Database(object):
         self.root = RootGroup()
         self.groups = []
         self.entries = []
+        self._groups_by_id = {}
+        self._entries_by_uuid = {}
+        self._group_ids = util.IdAllocator()
+        self._created = set()
+        self._removed = []
         self.readonly = False
         self.header = None
         self.password = None
         self.keyfile = None
+        self._transform = None
         self.filepath = None
     
     @property
@@ -118,7 +184,7 @@ class Database(object):
         assert len(self.groups) == 0, "initialize_empty() should only be used with a new database."
         return self.create_group(u'Internet', icon=1)
                 
-    def load(self, dbfile, password=None, keyfile=None, readonly=False):
+    def load(self, dbfile, password=None, keyfile=None, readonly=False, use_mmap=False):
         """
         Load the database from file/stream.
         
@@ -130,6 +196,9 @@ class Database(object):
         :type keyfile: str or file-like object
         :param readonly: Whether to open the database read-only.
         :type readonly: bool
+        :param use_mmap: Whether to memory-map the file (instead of reading it into memory);
+                         only applies to file paths.
+        :type use_mmap: bool
         """
         
         self._clear()
@@ -137,14 +206,35 @@ class Database(object):
         is_stream = hasattr(dbfile, 'read') 
         if is_stream:
             buf = dbfile.read()
+            self.load_from_buffer(buf, password=password, keyfile=keyfile, readonly=readonly)
         else:
             if not os.path.exists(dbfile):
                 raise IOError("File does not exist: {0}".format(dbfile))
             
             with open(dbfile, 'rb') as fp:
-                buf = fp.read()
-                
-        self.load_from_buffer(buf, password=password, keyfile=keyfile, readonly=readonly)
+                if use_mmap and os.path.getsize(dbfile) > 0:
+                    buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        self.load_from_buffer(buf, password=password, keyfile=keyfile, readonly=readonly)
+                    except:
+                        # The traceback frames (also of chained exceptions) still reference
+                        # (memoryview) views of the map, which keep it from being closed.
+                        error = sys.exc_info()[1]
+                        while error is not None and hasattr(traceback, 'clear_frames'):
+                            traceback.clear_frames(error.__traceback__)
+                            error = error.__context__
+                        error = None
+                        try:
+                            buf.close()
+                        except BufferError:
+                            # Don't let this hide the actual error.
+                            self.log.warning("Unable to close memory map of {0}; left to the garbage collector.".format(dbfile))
+                        raise
+                    else:
+                        buf.close()
+                else:
+                    buf = fp.read()
+                    self.load_from_buffer(buf, password=password, keyfile=keyfile, readonly=readonly)
         
         # One we have successfully loaded the file, go ahead and set the internal attribute
         # (in the LockingDatabase subclass, this will effectivley take out the lock on the file)
@@ -156,7 +246,8 @@ class Database(object):
         """
         Load a database from passed-in buffer (bytes).
 
-        :param buf: A string (bytes) of the database contents.
+        :param buf: A string (bytes) of the database contents (or other object supporting the
+                    buffer protocol, e.g. bytearray, memoryview or mmap).
         :type buf: str
         :param password: The password for the database.
         :type password: str
@@ -168,63 +259,239 @@ class Database(object):
         if password is None and keyfile is None:
             raise ValueError("Password and/or keyfile is required.")
         
+        if self.lazy_entries and self.entry_class is not Entry:
+            raise ValueError("lazy_entries cannot be combined with entry_class {0!r} (entries are "
+                             "loaded as LazyEntry).".format(self.entry_class))
+        
         # Save these to use as defaults when saving the database
         self.password = password
         self.keyfile = keyfile
         
         # The header is 124 bytes long, the rest is content
         hdr_len = HeaderStruct.length
-        header_bytes = buf[:hdr_len]
-        crypted_content = buf[hdr_len:]
+        header_bytes = bytes(bytearray(buf[:hdr_len]))
+        crypted_content = util.buffer_view(buf, hdr_len)
         
         self.header = HeaderStruct(header_bytes)
         
-        self.log.debug("Extracted header: {0}".format(self.header))
-        # Check if the database is supported
-        if self.header.version & const.DB_SUPPORTED_VERSION_MASK != const.DB_SUPPORTED_VERSION & const.DB_SUPPORTED_VERSION_MASK:
-            raise exc.UnsupportedDatabaseVersion('Unsupported file version: {0}'.format(hex(self.header.version)))
-            
-        #Actually, only AES is supported.
-        if not self.header.flags & HeaderStruct.AES:
-            raise exc.UnsupportedDatabaseEncryption('Only AES encryption is supported.')
+        self.log.debug("Extracted header: %r", self.header)
+        self._check_header(self.header)
         
-        final_key = util.derive_key(seed_key=self.header.seed_key,
-                                    seed_rand=self.header.seed_rand,
-                                    rounds=self.header.key_enc_rounds,
-                                    password=password, keyfile=keyfile)
+        final_key = self._derive_key(seed_key=self.header.seed_key,
+                                     seed_rand=self.header.seed_rand,
+                                     rounds=self.header.key_enc_rounds,
+                                     password=password, keyfile=keyfile)
         
-        # FIXME: Remove this once we've tracked down issues.
-        self.log.debug("(load) Final key: {0!r}, pass={1}".format(final_key, password))
+        # Most wrong keys can be rejected by decrypting just the final block.
+        if not util.final_padding_valid(crypted_content, key=final_key, iv=self.header.encryption_iv):
+            raise exc.AuthenticationError("Padding check failed. The key is wrong or the file is damaged.")
         
         decrypted_content = util.decrypt_aes_cbc(crypted_content, key=final_key, iv=self.header.encryption_iv)
         
-        # Check if decryption failed
-        if ((len(decrypted_content) > const.DB_MAX_CONTENT_LEN) or
-            (len(decrypted_content) == 0 and self.header.ngroups > 0)):
-            raise exc.IncorrectKey("Decryption failed! The key is wrong or the file is damaged.")
-        
-        if not self.header.contents_hash == hashlib.sha256(decrypted_content).digest():
-            self.log.debug("Decrypted content: {0!r}".format(decrypted_content))
-            self.log.error("Hash mismatch. Header hash = {0!r}, hash of contents = {1!r}".format(self.header.contents_hash,                                                                                                 hashlib.sha256(decrypted_content).digest()))
-            raise exc.AuthenticationError("Hash test failed. The key is wrong or the file is damaged.")
+        self._verify_content(self.header, len(decrypted_content), hashlib.sha256(decrypted_content).digest())
             
+        # The structs are parsed in place from the decrypted content; offset
+        # tracks where the next struct starts.
+        offset = 0
+        
         # First thing (after header) are the group definitions.
         for _i in range(self.header.ngroups):
-            gstruct = GroupStruct(decrypted_content)
-            self.groups.append(Group.from_struct(gstruct))
-            length = len(gstruct)
-            decrypted_content = decrypted_content[length:]
+            gstruct = GroupStruct()
+            start = offset
+            offset = gstruct.decode(decrypted_content, offset)
+            group = self.group_class.from_struct(gstruct)
+            if self.cache_encoded:
+                group._encoded = decrypted_content[start:offset]
+            self.groups.append(group)
         
         # Next come the entry definitions.
         for _i in range(self.header.nentries):
-            estruct = EntryStruct(decrypted_content)
-            self.entries.append(Entry.from_struct(estruct))
-            length = len(estruct)
-            decrypted_content = decrypted_content[length:]
+            if self.lazy_entries:
+                entry = LazyEntry(decrypted_content, offset)
+                offset = entry._end
+                self.entries.append(entry)
+            else:
+                estruct = EntryStruct()
+                start = offset
+                offset = estruct.decode(decrypted_content, offset)
+                entry = self.entry_class.from_struct(estruct)
+                if self.cache_encoded:
+                    entry._encoded = decrypted_content[start:offset]
+                self.entries.append(entry)
             
         # Sets up the hierarchy, relates the group/entry model objects.
         self._bind_model()
         
+    def iterload(self, dbfile, password=None, keyfile=None, readonly=False, chunk_size=65536):
+        """
+        Load the database from file/stream incrementally, yielding the groups and entries as
+        soon as they have been decrypted and parsed.
+        
+        The file is read, decrypted and hashed in chunks, so the whole file (or its decrypted
+        content) is never held in memory.  Note that the content hash can only be verified at
+        the end: the yielded objects are not bound to the hierarchy (or this database) and the
+        database itself is only populated once the content has been verified.  If verification
+        fails, the exception is raised at the end of the iteration.
+        
+        :param dbfile: The database file path/stream.
+        :type dbfile: str or file-like object
+        :param password: The password for the database.
+        :type password: str
+        :param keyfile: Path to a keyfile (or a stream) that can be used instead of or in conjunction with password for database.
+        :type keyfile: str or file-like object
+        :param readonly: Whether to open the database read-only.
+        :type readonly: bool
+        :param chunk_size: The number of bytes to read from the file at a time.
+        :type chunk_size: int
+        :returns: Generator of :class:`keepassdb.model.Group` and :class:`keepassdb.model.Entry` objects (in file order).
+        """
+        self._clear()
+        is_stream = hasattr(dbfile, 'read')
+        if is_stream:
+            fp = dbfile
+        else:
+            if not os.path.exists(dbfile):
+                raise IOError("File does not exist: {0}".format(dbfile))
+            fp = open(dbfile, 'rb')
+        
+        try:
+            for obj in self._iterload_stream(fp, password=password, keyfile=keyfile, chunk_size=chunk_size):
+                yield obj
+        finally:
+            if not is_stream:
+                fp.close()
+        
+        if not is_stream:
+            self.filepath = dbfile
+    
+    def _iterload_stream(self, fp, password=None, keyfile=None, chunk_size=65536):
+        """
+        Reads, decrypts and parses the database from file object (see :meth:`iterload`).
+        """
+        if password is None and keyfile is None:
+            raise ValueError("Password and/or keyfile is required.")
+        
+        header = HeaderStruct(fp.read(HeaderStruct.length))
+        self.log.debug("Extracted header: %r", header)
+        self._check_header(header)
+        
+        final_key = self._derive_key(seed_key=header.seed_key,
+                                     seed_rand=header.seed_rand,
+                                     rounds=header.key_enc_rounds,
+                                     password=password, keyfile=keyfile)
+        
+        self._check_final_padding(fp, final_key, iv=header.encryption_iv)
+        
+        decryptor = util.CbcDecryptor(final_key, iv=header.encryption_iv)
+        sha = hashlib.sha256()
+        content_len = 0
+        
+        groups = []
+        entries = []
+        num_records = header.ngroups + header.nentries
+        pending = bytearray() # decrypted content that has not been parsed yet
+        while True:
+            chunk = fp.read(chunk_size)
+            if chunk:
+                decrypted = decryptor.update(chunk)
+            else:
+                decrypted = decryptor.finalize()
+            sha.update(decrypted)
+            content_len += len(decrypted)
+            if content_len > const.DB_MAX_CONTENT_LEN:
+                raise exc.IncorrectKey("Decryption failed! The key is wrong or the file is damaged.")
+            
+            pending.extend(decrypted)
+            offset = 0
+            while len(groups) + len(entries) < num_records:
+                end = record_end(pending, offset)
+                if end is None:
+                    break
+                record = bytes(pending[offset:end])
+                if len(groups) < header.ngroups:
+                    gstruct = GroupStruct()
+                    gstruct.decode(record)
+                    obj = self.group_class.from_struct(gstruct)
+                    groups.append(obj)
+                else:
+                    estruct = EntryStruct()
+                    estruct.decode(record)
+                    obj = self.entry_class.from_struct(estruct)
+                    entries.append(obj)
+                if self.cache_encoded:
+                    obj._encoded = record
+                offset = end
+                yield obj
+            del pending[:offset]
+            
+            if not chunk:
+                break
+        
+        self._verify_content(header, content_len, sha.digest())
+        if len(groups) + len(entries) < num_records:
+            raise exc.ParseError("Content ended after {0} groups and {1} entries.".format(len(groups), len(entries)))
+        
+        # Everything checks out, populate the database.
+        self.header = header
+        self.password = password
+        self.keyfile = keyfile
+        self.groups = groups
+        self.entries = entries
+        self._bind_model()
+    
+    def _check_final_padding(self, fp, key, iv):
+        """
+        Checks the padding of the final block of the encrypted content (if the stream is seekable),
+        so that most wrong keys are rejected before the content is read (see :func:`keepassdb.util.final_padding_valid`).
+        
+        :raises: :class:`keepassdb.exc.AuthenticationError`
+        """
+        try:
+            if hasattr(fp, 'seekable') and not fp.seekable():
+                return
+            start = fp.tell()
+            fp.seek(0, os.SEEK_END)
+            size = fp.tell() - start
+        except (AttributeError, IOError, OSError):
+            return
+        try:
+            # The last two blocks (the previous block is the IV for the final block)
+            fp.seek(start + max(0, size - 32))
+            tail = fp.read()
+        finally:
+            fp.seek(start)
+        if size % 16 == 0 and not util.final_padding_valid(tail, key=key, iv=iv):
+            raise exc.AuthenticationError("Padding check failed. The key is wrong or the file is damaged.")
+    
+    def _check_header(self, header):
+        """
+        Checks that the database version and encryption (in header) are supported.
+        
+        :raises: :class:`keepassdb.exc.UnsupportedDatabaseVersion`, :class:`keepassdb.exc.UnsupportedDatabaseEncryption`
+        """
+        # Check if the database is supported
+        if header.version & const.DB_SUPPORTED_VERSION_MASK != const.DB_SUPPORTED_VERSION & const.DB_SUPPORTED_VERSION_MASK:
+            raise exc.UnsupportedDatabaseVersion('Unsupported file version: {0}'.format(hex(header.version)))
+            
+        #Actually, only AES is supported.
+        if not header.flags & HeaderStruct.AES:
+            raise exc.UnsupportedDatabaseEncryption('Only AES encryption is supported.')
+    
+    def _verify_content(self, header, content_len, content_hash):
+        """
+        Checks the length and hash of the decrypted content against the header.
+        
+        :raises: :class:`keepassdb.exc.IncorrectKey`, :class:`keepassdb.exc.AuthenticationError`
+        """
+        # Check if decryption failed
+        if ((content_len > const.DB_MAX_CONTENT_LEN) or
+            (content_len == 0 and header.ngroups > 0)):
+            raise exc.IncorrectKey("Decryption failed! The key is wrong or the file is damaged.")
+        
+        if not header.contents_hash == content_hash:
+            self.log.error("Hash mismatch. Header hash = {0!r}, hash of contents = {1!r}".format(header.contents_hash, content_hash))
+            raise exc.AuthenticationError("Hash test failed. The key is wrong or the file is damaged.")
+    
     def save(self, dbfile=None, password=None, keyfile=None):
         """
         Save the database to specified file/stream with password and/or keyfile.
@@ -257,59 +524,202 @@ class Database(object):
         if self.filepath is None and dbfile is None:
             raise ValueError("Unable to save without target file.")
         
-        buf = bytearray()
-        
-        # First, serialize the groups
-        for group in self.groups:
-            # Get the packed bytes
-            group_struct = group.to_struct()
-            self.log.debug("Group struct: {0!r}".format(group_struct))
-            buf += group_struct.encode()
-            
-        # Then the entries.
-        for entry in self.entries:
-            entry_struct = entry.to_struct()
-            buf += entry_struct.encode()
-
         # Hmmmm ... these defaults should probably be set elsewhere....?
         header = HeaderStruct()
         header.signature1 = const.DB_SIGNATURE1
         header.signature2 = const.DB_SIGNATURE2
         header.flags = header.AES
         header.version = 0x00030002
-        header.key_enc_rounds = 50000
-        header.seed_key = get_random_bytes(32)
         
-        # Convert buffer to bytes for API simplicity
-        buf = bytes(buf)
+        rounds = self._save_rounds()
+        transform = self._reusable_transform(password=password, keyfile=keyfile)
+        if transform is not None and transform[1] == rounds:
+            # Keep the transform seed (and rounds) so we don't need to derive the key again.
+            (header.seed_key, header.key_enc_rounds, transformed_key) = transform
+        else:
+            transform = None
+            header.key_enc_rounds = rounds
+            header.seed_key = get_random_bytes(32)
         
-        # Generate new seed & vector; update content hash        
+        # Generate new seed & vector
         header.encryption_iv = get_random_bytes(16)
         header.seed_rand = get_random_bytes(16)
-        header.contents_hash = hashlib.sha256(buf).digest()
         
-        self.log.debug("(Unencrypted) content: {0!r}".format(buf))
-        self.log.debug("Generating hash for {0}-byte content: {1}".format(len(buf), hashlib.sha256(buf).digest()))
         # Update num groups/entries to match curr state
         header.nentries = len(self.entries)
         header.ngroups = len(self.groups)
         
-        final_key = util.derive_key(seed_key=header.seed_key,
-                                    seed_rand=header.seed_rand,
-                                    rounds=header.key_enc_rounds,
-                                    password=password, keyfile=keyfile)
+        if transform is not None:
+            final_key = util.finalize_key(transformed_key, seed_rand=header.seed_rand)
+        else:
+            final_key = self._derive_key(seed_key=header.seed_key,
+                                         seed_rand=header.seed_rand,
+                                         rounds=header.key_enc_rounds,
+                                         password=password, keyfile=keyfile)
         
-        # FIXME: Remove this once we've tracked down issues.
-        self.log.debug("(save) Final key: {0!r}, pass={1}".format(final_key, password))
+        if hasattr(dbfile, 'write'):
+            self._write_encrypted(dbfile, header, final_key)
+        else:
+            self._write_file(self.filepath, header, final_key)
         
-        encrypted_content = util.encrypt_aes_cbc(buf, key=final_key, iv=header.encryption_iv)
+        self.header = header
+        self._mark_clean()
+    
+    def _save_rounds(self):
+        """
+        Returns the number of key transformation rounds to save with (see :attr:`save_rounds`).
         
-        if hasattr(dbfile, 'write'):
-            dbfile.write(header.encode() + encrypted_content)
+        :rtype: int
+        """
+        policy = self.save_rounds
+        if policy == 'preserve':
+            if self.header is not None and self.header.key_enc_rounds:
+                return self.header.key_enc_rounds
+            return const.DB_DEFAULT_KEY_ENC_ROUNDS
+        elif policy == 'calibrate':
+            target = self.calibrate_seconds
+            if target not in self._calibrated_rounds:
+                self._calibrated_rounds[target] = util.calibrate_rounds(target)
+            return self._calibrated_rounds[target]
+        
+        try:
+            rounds = int(policy)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid save_rounds policy: {0!r}".format(policy))
+        if not 1 <= rounds <= const.DB_MAX_KEY_ENC_ROUNDS:
+            raise ValueError("Key transformation rounds out of range: {0}".format(rounds))
+        return rounds
+    
+    def _write_file(self, path, header, final_key):
+        """
+        Writes the encrypted database to a temporary file in the same directory, which replaces
+        the file at path only once it has been written completely (so a failed save leaves the
+        existing file intact).
+        """
+        # (Resolve symlinks, so that the link target is replaced rather than the link.)
+        path = os.path.realpath(path)
+        (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                self._write_encrypted(fp, header, final_key)
+            if os.path.exists(path):
+                shutil.copymode(path, tmp_path)
+            else:
+                # mkstemp() creates the file with mode 0600; give new files the mode open() would.
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(tmp_path, 0o666 & ~umask)
+            # (os.rename() does not replace existing files on Windows.)
+            getattr(os, 'replace', os.rename)(tmp_path, path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    
+    def _iter_content(self):
+        """
+        Generates the serialized (unencrypted) content in chunks of roughly
+        :attr:`save_chunk_size` bytes.
+        
+        :rtype: generator of bytes
+        """
+        buf = bytearray()
+        
+        # First, serialize the groups (unchanged groups/entries reuse their encoded bytes)
+        for group in self.groups:
+            buf += group.encode(cache=self.cache_encoded)
+            if len(buf) >= self.save_chunk_size:
+                yield bytes(buf)
+                buf = bytearray()
+            
+        # Then the entries.
+        for entry in self.entries:
+            buf += entry.encode(cache=self.cache_encoded)
+            if len(buf) >= self.save_chunk_size:
+                yield bytes(buf)
+                buf = bytearray()
+        
+        if buf:
+            yield bytes(buf)
+    
+    def _write_encrypted(self, fp, header, final_key):
+        """
+        Serializes, hashes and encrypts the content chunk by chunk and writes it (and the header)
+        to the file object.
+        
+        For seekable files the header is written last (over a placeholder), since the content
+        hash is only known after all content has been processed.  For other streams the
+        content is serialized twice: once to compute the hash and once to encrypt it.
+        """
+        sha = hashlib.sha256()
+        encryptor = util.CbcEncryptor(final_key, iv=header.encryption_iv)
+        
+        try:
+            start = fp.tell()
+            seekable = fp.seekable() if hasattr(fp, 'seekable') else True
+        except (AttributeError, IOError, OSError):
+            seekable = False
+        
+        if seekable:
+            fp.write(b'\0' * HeaderStruct.length)
+            for chunk in self._iter_content():
+                sha.update(chunk)
+                fp.write(encryptor.update(chunk))
+            fp.write(encryptor.finalize())
+            end = fp.tell()
+            header.contents_hash = sha.digest()
+            fp.seek(start)
+            fp.write(header.encode())
+            fp.seek(end)
         else:
-            with open(self.filepath, "wb") as fp:
-                fp.write(header.encode() + encrypted_content)
-                        
+            for chunk in self._iter_content():
+                sha.update(chunk)
+            header.contents_hash = sha.digest()
+            fp.write(header.encode())
+            for chunk in self._iter_content():
+                fp.write(encryptor.update(chunk))
+            fp.write(encryptor.finalize())
+        
+        self.log.debug("Generated hash for content: %r", header.contents_hash)
+    
+    def _derive_key(self, seed_key, seed_rand, rounds, password=None, keyfile=None):
+        """
+        Derives the final key for specified header seeds and key material.
+        
+        If :attr:`reuse_transform_seed` is set, the transformed master key is retained so that
+        subsequent saves with the same password/keyfile can skip the key transformation.
+        
+        :rtype: bytes
+        """
+        if not self.reuse_transform_seed:
+            return util.derive_key(seed_key=seed_key, seed_rand=seed_rand, rounds=rounds,
+                                   password=password, keyfile=keyfile, cache=self.key_cache)
+        
+        masterkey = util.composite_key(password=password, keyfile=keyfile)
+        transformed_key = util.transform_master_key(masterkey, seed_key=seed_key, rounds=rounds)
+        if hasattr(keyfile, 'read'):
+            # (A keyfile stream cannot be read again to check that the key is unchanged.)
+            self._transform = None
+        else:
+            self._transform = (seed_key, rounds, masterkey, transformed_key)
+        return util.finalize_key(transformed_key, seed_rand=seed_rand)
+    
+    def _reusable_transform(self, password=None, keyfile=None):
+        """
+        Returns the retained (seed_key, rounds, transformed_key) if it can be used to save with
+        the specified password/keyfile, otherwise None.
+        
+        :rtype: tuple
+        """
+        if not self.reuse_transform_seed or self._transform is None or hasattr(keyfile, 'read'):
+            return None
+        (seed_key, rounds, masterkey, transformed_key) = self._transform
+        # Compare the (untransformed) master keys rather than the password and keyfile path,
+        # so that a keyfile whose contents have changed is not reused.
+        if util.composite_key(password=password, keyfile=keyfile) != masterkey:
+            return None
+        return (seed_key, rounds, transformed_key)
+    
     def create_group(self, title, parent=None, icon=1, expires=None):
         """
         This method creates a new group.
@@ -329,14 +739,12 @@ class Database(object):
         if expires is None:
             expires = const.NEVER
         
-        if self.groups:
-            group_id = max([g.id for g in self.groups]) + 1
-        else:
-            group_id = 1
+        group_id = self._group_ids.allocate()
         
-        group = Group(id=group_id, title=title, icon=icon, db=self, 
-                      created=util.now(), modified=util.now(), accessed=util.now(),
-                      expires=expires)
+        now = util.now()
+        group = self.group_class(id=group_id, title=title, icon=icon, db=self, 
+                                 created=now, modified=now, accessed=now,
+                                 expires=expires)
         
         # If no parent is given, just append the new group at the end
         if parent is None:
@@ -347,38 +755,72 @@ class Database(object):
             
         # Else insert the group behind the parent
         else:
-            if parent not in self.groups:
+            if not self._is_bound_group(parent):
                 raise ValueError("Group doesn't exist / is not bound to this database.")
             parent.children.append(group)
             group.parent = parent
             group.level = parent.level + 1
             self.groups.insert(self.groups.index(parent) + 1, group)
-                
+        
+        self._groups_by_id[group.id] = group
+        self._created.add(group)
+        
         return group
 
     def remove_group(self, group):
         """
         Remove the specified group.
         """
-        if not isinstance(group, Group):
-            raise TypeError("group must be Group")
-        if group not in self.groups:
-            raise ValueError("Group doesn't exist / is not bound to this database.")
+        self.remove_groups([group])
+    
+    def remove_groups(self, groups):
+        """
+        Remove the specified groups (and their sub-groups and entries).
         
-        #save num entries and children before removal to avoid for loop problems
-        num_entries = len(group.entries)
-        for i in xrange(num_entries):
-            self.remove_entry(group.entries[0])
-
-        # Recurse down to remove sub-groups
-        num_children = len(group.children)
-        for i in xrange(num_children): # We may need to copy this to avoid CME (see below)
-            self.remove_group(group.children[0])
+        The flat group and entry lists are rebuilt once for all removed groups.
         
-        # Finally remove group from the parent's list.
-        group.parent.children.remove(group) # Concurrent modification exception? Parent in recursive stack is iterating ...
-        self.groups.remove(group)
+        :param groups: The groups to remove.
+        :type groups: iterable of :class:`keepassdb.model.Group`
+        """
+        groups = list(groups)
+        for group in groups:
+            if not isinstance(group, Group):
+                raise TypeError("group must be Group")
+            if not self._is_bound_group(group):
+                raise ValueError("Group doesn't exist / is not bound to this database.")
         
+        removed = set()
+        def collect(group):
+            if group not in removed:
+                removed.add(group)
+                for child in group.children:
+                    collect(child)
+        for group in groups:
+            collect(group)
+        
+        removed_entries = set()
+        for group in removed:
+            removed_entries.update(group.entries)
+        
+        # Detach the removed (sub)trees from their remaining parents.
+        for parent in set(g.parent for g in removed if g.parent not in removed):
+            parent.children = [c for c in parent.children if c not in removed]
+        
+        self.groups = [g for g in self.groups if g not in removed]
+        self.entries = [e for e in self.entries if e not in removed_entries]
+        
+        for entry in removed_entries:
+            if self._entries_by_uuid.get(entry.uuid) is entry:
+                del self._entries_by_uuid[entry.uuid]
+            self._journal_removed(entry)
+        for group in removed:
+            self._journal_removed(group)
+            group.entries = []
+            group.children = []
+            if self._groups_by_id.get(group.id) is group:
+                del self._groups_by_id[group.id]
+                if self.reuse_group_ids:
+                    self._group_ids.release(group.id)
             
     def move_group(self, group, parent, index=None):
         """
@@ -403,10 +845,10 @@ class Database(object):
             
         if parent is None:
             parent = self.root
-        elif parent not in self.groups:
+        elif not self._is_bound_group(parent):
             raise exc.UnboundModelError("Parent group doesn't exist / is not bound to this database.")
             
-        if group not in self.groups:
+        if not self._is_bound_group(group):
             raise exc.UnboundModelError("Group doesn't exist / is not bound to this database.")
         
         curr_parent = group.parent
@@ -414,20 +856,24 @@ class Database(object):
         
         if index is None:
             parent.children.append(group)
-            self.log.debug("Moving {0!r} to child of {1!r}, (appending)".format(group, parent))
+            self.log.debug("Moving %r to child of %r, (appending)", group, parent)
         else:
             parent.children.insert(index, group)
-            self.log.debug("Moving {0!r} to child of {1!r}, (at position {2!r})".format(group, parent, index))
+            self.log.debug("Moving %r to child of %r, (at position %r)", group, parent, index)
         
         #Recurse down and reset level of all moved nodes
         def set_level(g):
-            g.level = g.parent.level + 1
+            level = g.parent.level + 1
+            if g.level != level:
+                g.level = level
+                g.dirty = True
             for child in g.children:
                 set_level(child)
 
         group.parent = parent
         set_level(group)
         group.modified = util.now()
+        group.dirty = True
         
         self._rebuild_groups()
 
@@ -467,22 +913,42 @@ class Database(object):
         :return: The new entry.
         :rtype: :class:`keepassdb.model.Entry`
         """
-        if group not in self.groups:
-            raise ValueError("Group doesn't exist / is not bound to this database.")
-                 
-        uuid = binascii.hexlify(get_random_bytes(16))
-        
-        entry = Entry(uuid=uuid,
-                      group_id=group.id,
-                      created=util.now(),
-                      modified=util.now(),
-                      accessed=util.now(),
-                      **kwargs)
+        return self.create_entries(group, [kwargs])[0]
+    
+    def create_entries(self, group, entries):
+        """
+        Create multiple new Entry objects in a group.
         
-        self.entries.append(entry)
-        group.entries.append(entry)
+        :param group: The associated group.
+        :type group: :class:`keepassdb.model.Group`
+        :param entries: The attributes for each new entry (see :meth:`create_entry` for keywords).
+        :type entries: iterable of dict
+        :return: The new entries.
+        :rtype: list
+        """
+        if not self._is_bound_group(group):
+            raise ValueError("Group doesn't exist / is not bound to this database.")
         
-        return entry
+        created = []
+        with util.clock.batch() as now:
+            for kwargs in entries:
+                uuid = binascii.hexlify(get_random_bytes(16))
+                
+                entry = self.entry_class(uuid=uuid,
+                                         group=group,
+                                         created=now,
+                                         modified=now,
+                                         accessed=now,
+                                         **kwargs)
+                created.append(entry)
+        
+        self.entries.extend(created)
+        group.entries.extend(created)
+        for entry in created:
+            self._entries_by_uuid[entry.uuid] = entry
+        self._created.update(created)
+        
+        return created
 
     def remove_entry(self, entry):
         """
@@ -493,11 +959,40 @@ class Database(object):
         """
         if not isinstance(entry, Entry):
             raise TypeError("entry param must be of type Entry.")
-        if not entry in self.entries:
+        if not self._is_bound_entry(entry):
             raise ValueError("Entry doesn't exist / not bound to this datbase.")
         
         entry.group.entries.remove(entry)
         self.entries.remove(entry)
+        if self._entries_by_uuid.get(entry.uuid) is entry:
+            del self._entries_by_uuid[entry.uuid]
+        self._journal_removed(entry)
+    
+    def remove_entries(self, entries):
+        """
+        Remove the specified entries.
+        
+        The flat entry list (and the entry lists of the affected groups) are rebuilt once.
+        
+        :param entries: The Entry objects to remove.
+        :type entries: iterable of :class:`keepassdb.model.Entry`
+        """
+        removed = set()
+        for entry in entries:
+            if not isinstance(entry, Entry):
+                raise TypeError("entry param must be of type Entry.")
+            if not self._is_bound_entry(entry):
+                raise ValueError("Entry doesn't exist / not bound to this datbase.")
+            removed.add(entry)
+        
+        for group in set(e.group for e in removed):
+            group.entries = [e for e in group.entries if e not in removed]
+        self.entries = [e for e in self.entries if e not in removed]
+        
+        for entry in removed:
+            if self._entries_by_uuid.get(entry.uuid) is entry:
+                del self._entries_by_uuid[entry.uuid]
+            self._journal_removed(entry)
 
     def move_entry(self, entry, group, index=None):
         """
@@ -518,9 +1013,9 @@ class Database(object):
         if not isinstance(group, Group):
             raise TypeError("group param must be of type Group")
         
-        if entry not in self.entries:
+        if not self._is_bound_entry(entry):
             raise exc.UnboundModelError("Invalid entry (or not bound to this database): {0!r}".format(entry))
-        if group not in self.groups:
+        if not self._is_bound_group(group):
             raise exc.UnboundModelError("Invalid group (or not bound to this database): {0!r}".format(group))
         
         curr_group = entry.group
@@ -528,14 +1023,15 @@ class Database(object):
         curr_group.entries.remove(entry)
         if index is None:
             group.entries.append(entry)
-            self.log.debug("Moving {0!r} to child of {1!r}, (appending)".format(entry, group))
+            self.log.debug("Moving %r to child of %r, (appending)", entry, group)
         else:
             group.entries.insert(index, entry)
-            self.log.debug("Moving {0!r} to child of {1!r}, (at position {2})".format(entry, group, index))
+            self.log.debug("Moving %r to child of %r, (at position %s)", entry, group, index)
             
         entry.group = group
         
         entry.modified = util.now()
+        entry.dirty = True
         
         self._rebuild_entries()
         
@@ -610,16 +1106,111 @@ class Database(object):
             prev_group = g
             
         # Bind group objects to entries
+        self._groups_by_id = {}
+        for group in self.groups:
+            # (First group wins for duplicate ids, same as the former linear search.)
+            self._groups_by_id.setdefault(group.id, group)
+            group.dirty = False
+        self._group_ids.reset(max(self._groups_by_id))
+        
+        self._entries_by_uuid = {}
         for entry in self.entries:
-            for group in self.groups:
-                if entry.group_id == group.id:
-                    group.entries.append(entry)
-                    entry.group = group
-                    break
-            else:
+            self._entries_by_uuid.setdefault(entry.uuid, entry)
+            group = self._groups_by_id.get(entry.group_id)
+            entry.dirty = group is None
+            if group is None:
                 # KeePassX adds these to the first group (i.e. root.children[0])
-                raise NotImplementedError("Orphaned entries not (yet) supported.")
+                group = self.root.children[0]
+                self.log.warning("Adding orphaned entry {0!r} (group_id={1}) to group {2!r}".format(entry, entry.group_id, group))
+            group.entries.append(entry)
+            entry.group = group
 
+    def changes(self):
+        """
+        Returns the changes made since the database was loaded (or last saved).
+        
+        :returns: List of (action, object) tuples, where action is 'created', 'modified' or 'removed'
+                  and object the group/entry; the list is empty if nothing changed.
+        :rtype: list
+        """
+        changes = []
+        for obj in chain(self.groups, self.entries):
+            if obj.dirty:
+                changes.append(('created' if obj in self._created else 'modified', obj))
+        changes.extend(('removed', obj) for obj in self._removed)
+        return changes
+    
+    def _journal_removed(self, obj):
+        """
+        Records the removal of a group/entry (removing a new object just undoes its creation).
+        """
+        if obj in self._created:
+            self._created.discard(obj)
+        else:
+            self._removed.append(obj)
+    
+    def _mark_clean(self):
+        """
+        Resets the dirty flags and change journal (after the database has been saved).
+        """
+        for obj in chain(self.groups, self.entries):
+            obj.dirty = False
+        self._created = set()
+        self._removed = []
+    
+    def _is_bound_group(self, group):
+        """
+        Whether the group belongs to this database (the linear search is only needed
+        for groups that share an id with another group).
+        """
+        return self._groups_by_id.get(group.id) is group or group in self.groups
+    
+    def _is_bound_entry(self, entry):
+        """
+        Whether the entry belongs to this database.
+        """
+        return self._entries_by_uuid.get(entry.uuid) is entry or entry in self.entries
+    
+    def get_group(self, id):
+        """
+        Returns the group with specified id.
+        
+        :param id: The group id.
+        :type id: int
+        :return: The group or None if no group with that id exists.
+        :rtype: :class:`keepassdb.model.Group`
+        """
+        return self._groups_by_id.get(id)
+    
+    def get_entry(self, uuid):
+        """
+        Returns the entry with specified uuid.
+        
+        :param uuid: The (hex-encoded) entry uuid.
+        :type uuid: str
+        :return: The entry or None if no entry with that uuid exists.
+        :rtype: :class:`keepassdb.model.Entry`
+        """
+        return self._entries_by_uuid.get(uuid)
+    
+    def find_groups(self, **kwargs):
+        """
+        Returns the groups whose attributes match all specified values (e.g. `title='eMail'`).
+        
+        :rtype: list
+        """
+        criteria = kwargs.items()
+        return [g for g in self.groups if all(getattr(g, k) == v for (k, v) in criteria)]
+    
+    def find_entries(self, **kwargs):
+        """
+        Returns the entries whose attributes match all specified values (e.g. `title='Gmail'`).
+        
+        :rtype: list
+        """
+        criteria = kwargs.items()
+        return [e for e in self.entries if all(getattr(e, k) == v for (k, v) in criteria)]
+    
     def close(self):
         """
         Closes the database, performs any necessary cleanup functions.
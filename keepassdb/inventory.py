@@ -0,0 +1,198 @@
+"""
+Header-only inspection of database files.
+
+The functions in this module only read the (unencrypted) 124-byte header of the
+database files, so they do not need the password/keyfile and do not derive keys
+or decrypt any content.
+"""
+__authors__ = ["Hans Lellelid <hans@xmpl.org>"]
+__license__ = """
+keepassdb is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or at your option) any later version.
+
+keepassdb is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+keepassdb.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import os.path
+import json
+import fnmatch
+import logging
+import tempfile
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+from keepassdb import exc
+from keepassdb.structs import HeaderStruct
+
+HeaderInfo = namedtuple('HeaderInfo', ['version', 'flags', 'ngroups', 'nentries', 'key_enc_rounds'])
+
+log = logging.getLogger(__name__)
+
+def probe(dbfile):
+    """
+    Reads the header of a database file.
+
+    :param dbfile: The database file path/stream (read from the current position).
+    :type dbfile: str or file-like object
+    :rtype: :class:`HeaderInfo`
+    :raises: :class:`keepassdb.exc.ParseError` - If the file is too short.
+    :raises: :class:`keepassdb.exc.InvalidDatabase` - If the file is not a KeePass 1.x database.
+    """
+    if hasattr(dbfile, 'read'):
+        buf = dbfile.read(HeaderStruct.length)
+    else:
+        with open(dbfile, 'rb') as fp:
+            buf = fp.read(HeaderStruct.length)
+    if len(buf) < HeaderStruct.length:
+        # (HeaderStruct would not decode an empty buffer at all.)
+        raise exc.ParseError("File too short for a database header: {0} bytes".format(len(buf)))
+    header = HeaderStruct(buf)
+    return HeaderInfo(version=header.version, flags=header.flags, ngroups=header.ngroups,
+                      nentries=header.nentries, key_enc_rounds=header.key_enc_rounds)
+
+def _probe_file(args):
+    """ Probes a file for :func:`scan` (in the worker threads). """
+    (path, size, mtime) = args
+    try:
+        return (path, size, mtime, probe(path), None)
+    except (exc.KPError, IOError, OSError) as e:
+        return (path, size, mtime, None, str(e))
+
+class Inventory(object):
+    """
+    Scans directories for database files and reads their headers (in parallel).
+
+    The results are kept in a sidecar index (a JSON file) keyed by (path, size, mtime), so
+    files that have not changed since the last scan are not read again.
+
+    :ivar index_path: The path to the index file (None to not keep an index).
+    :ivar pattern: The filename pattern of the database files.
+    :ivar workers: The number of threads used to read the file headers.
+    :ivar files: The index of scanned files: path -> (size, mtime, :class:`HeaderInfo` or None, error or None).
+    """
+    index_version = 1
+
+    def __init__(self, index_path=None, pattern='*.kdb', workers=8):
+        """
+        :param index_path: The path to the (JSON) sidecar index (read if it exists).
+        :type index_path: str
+        :param pattern: The filename pattern of the database files.
+        :type pattern: str
+        :param workers: The number of threads used to read the file headers.
+        :type workers: int
+        """
+        self.index_path = index_path
+        self.pattern = pattern
+        self.workers = workers
+        self.files = {}
+        if index_path is not None and os.path.exists(index_path):
+            self.load_index()
+
+    def load_index(self):
+        """
+        Reads the sidecar index (ignoring it if it cannot be read).
+        """
+        try:
+            with open(self.index_path, 'r') as fp:
+                data = json.load(fp)
+            if data.get('version') != self.index_version:
+                raise ValueError("Unsupported index version: {0!r}".format(data.get('version')))
+            files = {}
+            for (path, item) in data['files'].items():
+                info = HeaderInfo(**item['info']) if item.get('info') is not None else None
+                files[path] = (item['size'], item['mtime'], info, item.get('error'))
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            log.warning("Ignoring unreadable inventory index {0}: {1}".format(self.index_path, e))
+            return
+        self.files = files
+
+    def save_index(self):
+        """
+        Writes the sidecar index (atomically replacing the previous one).
+        """
+        files = {}
+        for (path, (size, mtime, info, error)) in self.files.items():
+            files[path] = dict(size=size, mtime=mtime, error=error,
+                               info=dict(info._asdict()) if info is not None else None)
+        # (A unique temporary file, so that concurrent scans do not write to the same file.)
+        (directory, filename) = os.path.split(os.path.abspath(self.index_path))
+        (fd, tmp_path) = tempfile.mkstemp(dir=directory, prefix=filename + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(dict(version=self.index_version, files=files), fp)
+            # mkstemp() creates the file with mode 0600; use the mode open() would.
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+            # (os.rename() does not replace existing files on Windows.)
+            getattr(os, 'replace', os.rename)(tmp_path, self.index_path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def find_files(self, directory):
+        """
+        Finds the database files (matching :attr:`pattern`) in the directory tree.
+
+        :returns: Generator of (path, size, mtime) tuples.
+        """
+        for (dirpath, _dirnames, filenames) in os.walk(directory):
+            for filename in fnmatch.filter(filenames, self.pattern):
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield (path, st.st_size, st.st_mtime)
+
+    def scan(self, directory):
+        """
+        Reads the headers of the database files in the directory tree.
+
+        Only new and changed files are read; the index is updated (and saved if
+        :attr:`index_path` is set) with the results.  Files that are no longer found
+        in the directory tree are removed from the index.
+
+        :param directory: The directory to scan (recursively).
+        :type directory: str
+        :returns: Dict of path -> :class:`HeaderInfo` for the valid database files.
+        :rtype: dict
+        """
+        directory = os.path.abspath(directory)
+        found = list(self.find_files(directory))
+        stale = []
+        for (path, size, mtime) in found:
+            indexed = self.files.get(path)
+            if indexed is None or indexed[:2] != (size, mtime):
+                stale.append((path, size, mtime))
+
+        if stale:
+            pool = ThreadPool(max(1, min(self.workers, len(stale))))
+            try:
+                for (path, size, mtime, info, error) in pool.imap_unordered(_probe_file, stale):
+                    if error is not None:
+                        log.info("Unable to read header of {0}: {1}".format(path, error))
+                    self.files[path] = (size, mtime, info, error)
+            finally:
+                pool.close()
+                pool.join()
+
+        # Forget files that were removed (from the scanned directory only).
+        found_paths = set(path for (path, _, _) in found)
+        prefix = os.path.join(directory, '')
+        for path in list(self.files):
+            if path.startswith(prefix) and path not in found_paths:
+                del self.files[path]
+
+        if self.index_path is not None:
+            self.save_index()
+
+        return dict((path, self.files[path][2]) for path in found_paths
+                    if self.files[path][2] is not None)
@@ -21,10 +21,10 @@ keepassdb.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import abc
-import logging
 import base64
 
 from keepassdb import const, util
+from keepassdb.util import ClassLogger
 from keepassdb.structs import GroupStruct, EntryStruct
 
 __authors__ = ["Karsten-Kai König <kkoenig@posteo.de>", "Hans Lellelid <hans@xmpl.org>"]
@@ -44,14 +44,22 @@ keepassdb.  If not, see <http://www.gnu.org/licenses/>.
 
 class BaseModel(object):
     __metaclass__ = abc.ABCMeta
+    __slots__ = ()
     
-    def __init__(self):
-        self.log = logging.getLogger('{0}.{1}'.format(self.__module__, self.__class__.__name__))
+    log = ClassLogger()
+    
+    # The attributes that are saved (same as the struct attributes); assigning any of them marks the object dirty.
+    _struct_attributes = frozenset()
         
     @abc.abstractproperty
     def struct_type(self):
         pass
     
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._struct_attributes:
+            object.__setattr__(self, 'dirty', True)
+    
     @classmethod
     def from_struct(cls, structobj):
         """
@@ -68,9 +76,28 @@ class BaseModel(object):
         """
         structobj = self.struct_type()
         for k in structobj.attributes():
-            self.log.info("Setting attribute %s to %r" % (k, getattr(self, k)))
             setattr(structobj, k, getattr(self, k))
         return structobj
+    
+    def encode(self, cache=True):
+        """
+        Returns the encoded struct bytes for this object.
+        
+        The bytes read when loading (or encoded at the last save) are reused as long as
+        the object is not dirty.
+        
+        :param cache: Whether to use (and update) the cached bytes.
+        :type cache: bool
+        :rtype: bytes
+        """
+        if cache:
+            encoded = self._encoded
+            if encoded is not None and not self.dirty:
+                return encoded
+        encoded = self.to_struct().encode()
+        if cache:
+            self._encoded = encoded
+        return encoded
         
 class RootGroup(object):
     """
@@ -98,10 +125,13 @@ class RootGroup(object):
     def __repr__(self):
         return '<RootGroup>'
     
-class Group(BaseModel):
+class GroupBase(BaseModel):
     """
     Represents a single group of a KeePass 1.x database.
     
+    This base class implements the group behavior; instances are created from the
+    :class:`Group` (regular) or :class:`CompactGroup` (memory-efficient) subclasses.
+    
     :ivar db: The parent database (:class:`keepassdb.db.Database`)
     :ivar id: The group numeric id (unsigned int)
     :ivar title: The group title (string)
@@ -110,7 +140,10 @@ class Group(BaseModel):
     :ivar parent: The parent group (:class:`keepassdb.model.Group`)
     :ivar children: List of children groups (:class:`keepassdb.model.Group`)
     :ivar entries: List of member entries (:class:`keepassdb.model.Entry`)
+    :ivar dirty: Whether the group was created or changed (by assigning its attributes or moving it)
+                 since the database was loaded or saved.
     """
+    __slots__ = ()
     
     # These are the shadow attribs for our getters and setters
     _title = None
@@ -118,6 +151,7 @@ class Group(BaseModel):
     _expires = None
 
     struct_type = GroupStruct
+    _struct_attributes = frozenset(GroupStruct().attributes())
     
     def __init__(self, id=None, title=None, icon=None, level=None, created=None, modified=None,
                  accessed=None, expires=None, flags=None, parent=None, db=None):
@@ -127,15 +161,17 @@ class Group(BaseModel):
         Use the :method:`Group.parse` class method if you would like to initialize a group
         from the data structure.
         """
-        super(Group, self).__init__()
+        super(GroupBase, self).__init__()
         if icon is None:
             icon = 1            
-        if created is None:
-            created = util.now()
-        if modified is None:
-            modified = util.now()
-        if accessed is None:
-            accessed = util.now()
+        if created is None or modified is None or accessed is None:
+            now = util.now()
+            if created is None:
+                created = now
+            if modified is None:
+                modified = now
+            if accessed is None:
+                accessed = now
         if expires is None:
             expires = const.NEVER
         if flags is None:
@@ -156,6 +192,8 @@ class Group(BaseModel):
         self.db = db
         self.children = []
         self.entries = []
+        self.dirty = True
+        self._encoded = None
     
     def __repr__(self):
         return '<Group title={0} id={1} level={2}>'.format(self.title,
@@ -170,6 +208,7 @@ class Group(BaseModel):
     def title(self, value):
         self._title = value
         self.modified = util.now()
+        self.dirty = True
     
     @property
     def icon(self):
@@ -179,6 +218,7 @@ class Group(BaseModel):
     def icon(self, value):
         self._icon = value
         self.modified = util.now()
+        self.dirty = True
         
     @property
     def expires(self):
@@ -188,6 +228,7 @@ class Group(BaseModel):
     def expires(self, value):
         self._expires = value
         self.modified = util.now()
+        self.dirty = True
         
     def move(self, parent, index=None):
         """
@@ -247,10 +288,31 @@ class Group(BaseModel):
             
         return d
     
-        
-class Entry(BaseModel):
+
+class Group(GroupBase):
+    """
+    Represents a single group of a KeePass 1.x database (see :class:`GroupBase`).
+    """
+
+class CompactGroup(GroupBase):
+    """
+    A group that keeps its attributes in `__slots__` rather than a per-instance dict.
+    
+    Compact groups use considerably less memory (see `benchmarks/bench_model_memory.py`),
+    but cannot be given arbitrary extra attributes.  They are registered as virtual
+    subclass of :class:`Group`.
+    """
+    __slots__ = ('id', '_title', '_icon', 'level', 'created', 'modified', 'accessed',
+                 '_expires', 'flags', 'parent', 'db', 'children', 'entries', 'dirty', '_encoded')
+
+Group.register(CompactGroup)
+
+class EntryBase(BaseModel):
     """Entry represents a simple entry of a KeePass 1.x database.
     
+    This base class implements the entry behavior; instances are created from the
+    :class:`Entry` (regular) or :class:`CompactEntry` (memory-efficient) subclasses.
+    
     :ivar uuid: The ID for the entry.
     :ivar group_id: The numeric ID for the group.
     :ivar group: The group object that this entity is related to.
@@ -266,9 +328,13 @@ class Entry(BaseModel):
     :ivar expires: When the entry (password) expires.  Default will be :ref:`keepassdb.const.NEVER`.
     :ivar binary_desc: Description/metadata for the binary column.
     :ivar binary: Binary contents.
+    :ivar dirty: Whether the entry was created or changed (by assigning its attributes or moving it)
+                 since the database was loaded or saved.
     """ 
+    __slots__ = ()
     
     struct_type = EntryStruct
+    _struct_attributes = frozenset(EntryStruct().attributes())
     _group = None
 
     def __init__(self, uuid = None, group_id = None, group = None,
@@ -327,15 +393,17 @@ class Entry(BaseModel):
         :keyword binary: Binary contents.
         :type binary: str
         """
-        super(Entry, self).__init__()
+        super(EntryBase, self).__init__()
         if icon is None:
             icon = 1    
-        if created is None:
-            created = util.now()
-        if modified is None:
-            modified = util.now()
-        if accessed is None:
-            accessed = util.now()
+        if created is None or modified is None or accessed is None:
+            now = util.now()
+            if created is None:
+                created = now
+            if modified is None:
+                modified = now
+            if accessed is None:
+                accessed = now
         if expires is None:
             expires = const.NEVER
         
@@ -363,8 +431,10 @@ class Entry(BaseModel):
         self.modified = modified
         self.accessed = accessed
         self._expires = expires
-        self.binary_desc = binary_desc
-        self.binary = binary
+        self._binary_desc = binary_desc
+        self._binary = binary
+        self.dirty = True
+        self._encoded = None
 
     def __repr__(self):
         return '<Entry title={0} username={1}>'.format(self.title,
@@ -377,7 +447,7 @@ class Entry(BaseModel):
     @group.setter
     def group(self, value):
         self._group = value
-        if value is not None:
+        if value is not None and self.group_id != value.id:
             self.group_id = value.id
         
     @property
@@ -388,6 +458,7 @@ class Entry(BaseModel):
     def title(self, value):
         self._title = value
         self.modified = util.now()
+        self.dirty = True
     
     
     @property
@@ -398,6 +469,7 @@ class Entry(BaseModel):
     def icon(self, value):
         self._icon = value
         self.modified = util.now()
+        self.dirty = True
     
     @property
     def url(self):
@@ -407,6 +479,7 @@ class Entry(BaseModel):
     def url(self, value):
         self._url = value
         self.modified = util.now()
+        self.dirty = True
     
     @property
     def username(self):
@@ -416,6 +489,7 @@ class Entry(BaseModel):
     def username(self, value):
         self._username = value
         self.modified = util.now()
+        self.dirty = True
     
     @property
     def password(self):
@@ -425,6 +499,7 @@ class Entry(BaseModel):
     def password(self, value):
         self._password = value
         self.modified = util.now()
+        self.dirty = True
         
     @property
     def notes(self):
@@ -434,6 +509,7 @@ class Entry(BaseModel):
     def notes(self, value):
         self._notes = value
         self.modified = util.now()
+        self.dirty = True
         
     @property
     def expires(self):
@@ -443,6 +519,27 @@ class Entry(BaseModel):
     def expires(self, value):
         self._expires = value
         self.modified = util.now()
+        self.dirty = True
+    
+    @property
+    def binary_desc(self):
+        return self._binary_desc
+    
+    @binary_desc.setter
+    def binary_desc(self, value):
+        self._binary_desc = value
+        self.modified = util.now()
+        self.dirty = True
+    
+    @property
+    def binary(self):
+        return self._binary
+    
+    @binary.setter
+    def binary(self, value):
+        self._binary = value
+        self.modified = util.now()
+        self.dirty = True
         
     def move(self, group, index=None):
         """
@@ -477,4 +574,84 @@ class Entry(BaseModel):
                  binary_desc=self.binary_desc,
                  binary=base64.b64encode(self.binary) if self.binary is not None else ''
                  )
-        return d
\ No newline at end of file
+        return d
+
+
+class Entry(EntryBase):
+    """
+    Entry represents a simple entry of a KeePass 1.x database (see :class:`EntryBase`).
+    """
+
+class CompactEntry(EntryBase):
+    """
+    An entry that keeps its attributes in `__slots__` rather than a per-instance dict.
+    
+    See :class:`CompactGroup`; registered as virtual subclass of :class:`Entry`.
+    """
+    __slots__ = ('uuid', 'group_id', '_group', '_icon', '_title', '_url', '_username', '_password',
+                 '_notes', 'created', 'modified', 'accessed', '_expires', '_binary_desc', '_binary',
+                 'dirty', '_encoded')
+
+Entry.register(CompactEntry)
+
+class LazyEntry(Entry):
+    """
+    An entry that decodes its fields from the (decrypted) database content on first access.
+    
+    Only the uuid and group_id are decoded up-front; the entry keeps a reference to the
+    content buffer and the offsets of its fields.  This is used when loading with
+    :attr:`keepassdb.db.Database.lazy_entries` set.
+    """
+    
+    # Lazily decoded attributes (including the shadow attribs of the properties) -> (field type, default factory)
+    _lazy_fields = {
+        '_icon': (0x3, lambda: 1),
+        '_title': (0x4, lambda: u''),
+        '_url': (0x5, lambda: u''),
+        '_username': (0x6, lambda: None),
+        '_password': (0x7, lambda: None),
+        '_notes': (0x8, lambda: u''),
+        'created': (0x9, util.now),
+        'modified': (0xa, util.now),
+        'accessed': (0xb, util.now),
+        '_expires': (0xc, lambda: const.NEVER),
+        '_binary_desc': (0xd, lambda: u''),
+        '_binary': (0xe, lambda: b''),
+    }
+    
+    def __init__(self, buf, offset=0):
+        """
+        Initialize the entry from the struct at specified offset of the content buffer.
+        
+        :param buf: The decrypted database content.
+        :param offset: The offset of the entry struct in buf.
+        :type offset: int
+        """
+        (self._fields, self._end) = EntryStruct.scan(buf, offset)
+        self._buf = buf
+        self._offset = offset
+        self.uuid = self._decode(0x1)
+        self.group_id = self._decode(0x2)
+        self.dirty = False
+    
+    def _decode(self, typ):
+        (offset, size) = self._fields[typ]
+        return EntryStruct.decode_field(self._buf, typ, offset, size)
+    
+    def __getattr__(self, name):
+        # Only called for attributes that have not been set (i.e. decoded) yet.
+        if name == '_encoded':
+            # The original struct bytes (sliced on demand rather than kept as a copy).
+            return self._buf[self._offset:self._end]
+        try:
+            (typ, default) = self._lazy_fields[name]
+        except KeyError:
+            raise AttributeError(name)
+        if typ in self._fields:
+            value = self._decode(typ)
+        else:
+            value = default()
+        # (Decoding is not a change, so bypass the dirty tracking.)
+        object.__setattr__(self, name, value)
+        return value
+
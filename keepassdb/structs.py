@@ -25,6 +25,10 @@ from datetime import datetime
 from binascii import hexlify, unhexlify
 
 from keepassdb import exc, const
+from keepassdb.util import ClassLogger
+
+# The [FIELDTYPE][FIELDSIZE] header that precedes each group/entry field.
+TLV_HEADER = struct.Struct('<H L')
 
 class Marshall(object):
     """ Abstract base class for the marshall implementations. """
@@ -115,24 +119,39 @@ class MarshallAscii(Marshall):
     
 class MarshallShort(Marshall):
     """ Encode/decode short int values. """
+    _struct = struct.Struct("<H")
+    
     def encode(self, val):
-        return struct.pack("<H", val)
+        return self._struct.pack(val)
     
     def decode(self, buf):
-        return struct.unpack("<H", buf)[0]
+        return self._struct.unpack(buf)[0]
     
 class MarshallInt(Marshall):
     """ Encode/decode int/long values. """
+    _struct = struct.Struct("<L")
+    
     def encode(self, val):
-        return struct.pack("<L", val)
+        return self._struct.pack(val)
     
     def decode(self, buf):
-        return struct.unpack("<L", buf)[0]
+        return self._struct.unpack(buf)[0]
          
 class MarshallDate(Marshall):
     """
     Marshall the date format needed for keepass db to/from python datetime objects.
+    
+    Decoded/encoded values are interned in caches shared by all instances (databases
+    tend to contain many identical timestamps, :data:`keepassdb.const.NEVER` in particular).
+    The caches are simply cleared when they grow beyond :attr:`cache_size` entries.
+    
+    :cvar cache_size: The maximum number of values kept in each of the caches.
     """
+    cache_size = 4096
+    
+    _struct = struct.Struct('<5B')
+    _decode_cache = {}
+    _encode_cache = {}
     
     def decode(self, buf):
         """
@@ -141,13 +160,60 @@ class MarshallDate(Marshall):
         :returns: The decoded datetime object.
         :rtype: :class:`datetime.datetime`
         """
-        date_field = struct.unpack('<5B', buf)
-        dw1 = date_field[0]
-        dw2 = date_field[1]
-        dw3 = date_field[2]
-        dw4 = date_field[3]
-        dw5 = date_field[4]
-
+        if buf == NEVER_BYTES:
+            return const.NEVER
+        try:
+            return self._decode_cache[buf]
+        except KeyError:
+            pass
+        # (Ensure that we don't key the cache on a mutable buffer.)
+        buf = bytes(buf)
+        value = self._decode(buf)
+        if len(self._decode_cache) >= self.cache_size:
+            self._decode_cache.clear()
+        self._decode_cache[buf] = value
+        return value
+    
+    def decode_many(self, bufs):
+        """
+        Decodes a run of date fields.
+        
+        The fields are unpacked together (with a single struct for the whole run rather
+        than one unpack call per field) and each distinct value is only converted once.
+        
+        :param bufs: Iterable of 5-byte date fields.
+        :returns: The decoded datetime objects (in same order).
+        :rtype: list
+        :raises: :class:`struct.error` - If a field is not 5 bytes long.
+        """
+        bufs = [bytes(buf) for buf in bufs]
+        data = b''.join(bufs)
+        if len(data) != self._struct.size * len(bufs):
+            raise struct.error("Date fields must be {0} bytes long.".format(self._struct.size))
+        octets = struct.Struct('<{0}B'.format(len(data))).unpack(data)
+        
+        to_datetime = self._to_datetime
+        converted = {NEVER_BYTES: const.NEVER}
+        values = []
+        for (buf, dw1, dw2, dw3, dw4, dw5) in zip(bufs, octets[0::5], octets[1::5], octets[2::5],
+                                                  octets[3::5], octets[4::5]):
+            value = converted.get(buf)
+            if value is None:
+                value = converted[buf] = to_datetime(dw1, dw2, dw3, dw4, dw5)
+            values.append(value)
+        return values
+    
+    def _decode(self, buf):
+        """
+        Decodes the date field (without caching).
+        """
+        return self._to_datetime(*self._struct.unpack(buf))
+    
+    @staticmethod
+    def _to_datetime(dw1, dw2, dw3, dw4, dw5):
+        """
+        Converts the 5 bytes of a date field into a datetime object.
+        """
         y = (dw1 << 6) | (dw2 >> 2)
         mon = ((dw2 & 0x03) << 2) | (dw3 >> 6)
         d = (dw3 >> 1) & 0x1F
@@ -165,6 +231,20 @@ class MarshallDate(Marshall):
         :returns: Bytes for data. 
         :rtype: str
         """
+        try:
+            return self._encode_cache[val]
+        except KeyError:
+            pass
+        buf = self._encode(val)
+        if len(self._encode_cache) >= self.cache_size:
+            self._encode_cache.clear()
+        self._encode_cache[val] = buf
+        return buf
+    
+    def _encode(self, val):
+        """
+        Encode the datetime value (without caching).
+        """
         # Just copied from original KeePassX source
         y, mon, d, h, min_, s = val.timetuple()[:6]
 
@@ -175,8 +255,10 @@ class MarshallDate(Marshall):
         dw4 = 0x0000FFFF & (((h & 0x0000000F) << 4) | ((min_ >> 2) & 0x0000000F))
         dw5 = 0x0000FFFF & (((min_ & 0x00000003) << 6) | (s & 0x0000003F))
 
-        return struct.pack('<5B', dw1, dw2, dw3, dw4, dw5) 
-    
+        return self._struct.pack(dw1, dw2, dw3, dw4, dw5) 
+
+# The encoded form of the :data:`keepassdb.const.NEVER` date.
+NEVER_BYTES = MarshallDate()._encode(const.NEVER)
     
 class StructBase(object):
     """
@@ -185,12 +267,14 @@ class StructBase(object):
     __metaclass__ = abc.ABCMeta
     
     order = None
+    _decoders = None # The compiled decode table for the class (see _compile_decoders())
     
-    def __init__(self, buf=None):
+    log = ClassLogger()
+    
+    def __init__(self, buf=None, offset=0):
         self.order = []         # keep field order
-        self.log = logging.getLogger('{0}.{1}'.format(self.__module__, self.__class__.__name__))
         if buf:
-            self.decode(buf)
+            self.decode(buf, offset)
 
     def __repr__(self):
         ret = [self.__class__.__name__ + ':']
@@ -227,39 +311,122 @@ class StructBase(object):
         """
         return dict([(name, getattr(self, name)) for (name, _) in self.format.values() if name is not None and not name.startswith('_')])
     
-    def decode(self, buf):
+    def decode(self, buf, offset=0):
         """
         Set object attributes from binary string representation.
         
+        The struct is read from the specified offset of the buffer, so that a whole
+        database can be parsed from a single buffer without copying the remainder.
+        
         :param buf: The binary string representation of this object in database.
         :type buf: str
+        :param offset: The offset in buf at which the struct starts.
+        :type offset: int
+        :returns: The offset just past the end of the struct.
+        :rtype: int
         :raises: :class:`keepassdb.exc.ParseError` - If errors encountered parsing struct.
         """
-        index = 0
+        decoders = self.__class__.__dict__.get('_decoders')
+        if decoders is None:
+            decoders = self._compile_decoders()
+        
+        debug = self.log.isEnabledFor(logging.DEBUG)
+        unpack_header = TLV_HEADER.unpack_from
+        order = self.order
+        index = offset
+        buflen = len(buf)
         while True:
-            #self.log.debug("buffer state: index={0}, buf-ahead={1!r}".format(index, buf[index:]))
-            substr = buf[index:index + 6]
-            index += 6
-            if index > len(buf):
-                raise ValueError("Group header offset is out of range: {0}".format(index))
-            (typ, siz) = struct.unpack('<H L', substr)
-            self.order.append((typ, siz))
-            
-            substr = buf[index:index + siz]
-            index += siz
-            encoded = struct.unpack('<%ds' % siz, substr)[0]
+            if index + TLV_HEADER.size > buflen:
+                raise ValueError("Group header offset is out of range: {0}".format(index + TLV_HEADER.size))
+            (typ, siz) = unpack_header(buf, index)
+            index += TLV_HEADER.size
+            order.append((typ, siz))
             
-            (name, marshall) = self.format[typ]
+            end = index + siz
+            if end > buflen:
+                raise exc.ParseError("Field data out of range: typ={0}, size={1}, offset={2}".format(typ, siz, index))
+            try:
+                (name, decode) = decoders[typ]
+            except KeyError:
+                raise exc.ParseError("Unknown field type: typ={0}, size={1}, offset={2}".format(typ, siz, index))
             if name is None:
+                index = end
                 break
+            encoded = bytes(buf[index:end])
+            index = end
             try:
-                value = marshall.decode(encoded)
-                self.log.debug("Decoded field [{0}] to value {1!r}".format(name, value))
+                value = decode(encoded)
             except struct.error, msg:
                 msg = '%s, typ=%d[size=%d] -> %s [buf = "%r"]' % \
                     (msg, typ, siz, self.format[typ], encoded)
                 raise exc.ParseError(msg)
+            if debug:
+                # (Field values may be secret, so only the size is logged.)
+                self.log.debug("Decoded field [%s] (%d bytes)", name, siz)
             setattr(self, name, value)
+        
+        return index
+    
+    @classmethod
+    def scan(cls, buf, offset=0):
+        """
+        Locates the fields of the struct starting at offset without decoding them.
+        
+        :param buf: The buffer containing the struct.
+        :param offset: The offset in buf at which the struct starts.
+        :returns: Tuple of ({field type: (data offset, data size)}, end offset of struct).
+        :rtype: tuple
+        :raises: :class:`keepassdb.exc.ParseError` - If the struct extends beyond the buffer.
+        """
+        fields = {}
+        index = offset
+        buflen = len(buf)
+        while True:
+            if index + TLV_HEADER.size > buflen:
+                raise exc.ParseError("Field header offset is out of range: {0}".format(index + TLV_HEADER.size))
+            (typ, siz) = TLV_HEADER.unpack_from(buf, index)
+            index += TLV_HEADER.size
+            if index + siz > buflen:
+                raise exc.ParseError("Field data out of range: typ={0}, size={1}, offset={2}".format(typ, siz, index))
+            if typ == 0xFFFF:
+                return (fields, index + siz)
+            fields[typ] = (index, siz)
+            index += siz
+    
+    @classmethod
+    def decode_field(cls, buf, typ, offset, size):
+        """
+        Decodes a single field (as located by :meth:`scan`).
+        
+        :returns: The decoded value.
+        :raises: :class:`keepassdb.exc.ParseError` - If the field cannot be decoded.
+        """
+        decoders = cls.__dict__.get('_decoders')
+        if decoders is None:
+            decoders = cls._compile_decoders()
+        (name, decode) = decoders[typ]
+        encoded = bytes(buf[offset:offset + size])
+        try:
+            return decode(encoded)
+        except struct.error, msg:
+            raise exc.ParseError('%s, typ=%d[size=%d] -> %s' % (msg, typ, size, name))
+    
+    @classmethod
+    def _compile_decoders(cls):
+        """
+        Builds (and stores on the class) the field type -> (name, decode function) table
+        used by :meth:`decode`.
+        
+        :rtype: dict
+        """
+        decoders = {}
+        for (typ, (name, marshall)) in cls.format.items():
+            if name is None:
+                decoders[typ] = (None, None)
+            else:
+                decoders[typ] = (name, marshall.decode)
+        cls._decoders = decoders
+        return decoders
 
     def __len__(self):
         length = 0
@@ -273,6 +440,7 @@ class StructBase(object):
         
         :rtype: str
         """
+        debug = self.log.isEnabledFor(logging.DEBUG)
         buf = bytearray()
         for typ in sorted(self.format.keys()):
             encoded = None
@@ -282,9 +450,11 @@ class StructBase(object):
                 if value is not None:
                     try:
                         encoded = marshall.encode(value)
-                        self.log.debug("Encoded field [{0}] to value {1!r}".format(name, encoded))
+                        if debug:
+                            # (Field values may be secret, so only the size is logged.)
+                            self.log.debug("Encoded field [%s] (%d bytes)", name, len(encoded))
                     except:
-                        self.log.exception("Error encoding key/value: key={0}, value={1!r}".format(name, value))
+                        self.log.exception("Error encoding field %s (value of type %s)", name, type(value).__name__)
                         raise
             
             # Note, there is an assumption here that encode() func is returning
@@ -312,6 +482,25 @@ class StructBase(object):
         return "/" + path
 
     
+def record_end(buf, offset=0):
+    """
+    Finds the end of the group/entry record that starts at offset.
+    
+    :param buf: The buffer containing the (possibly incomplete) record.
+    :param offset: The offset at which the record starts.
+    :returns: The offset just past the end of the record, or None if the buffer ends before
+              the record is complete.
+    :rtype: int
+    """
+    index = offset
+    buflen = len(buf)
+    while index + TLV_HEADER.size <= buflen:
+        (typ, siz) = TLV_HEADER.unpack_from(buf, index)
+        index += TLV_HEADER.size + siz
+        if typ == 0xFFFF:
+            return index if index <= buflen else None
+    return None
+    
 class GroupStruct(StructBase):
     """
     Structure representing a single group.
@@ -510,6 +699,9 @@ class HeaderStruct(object):
     )
 
     length = 124
+    
+    # The compiled format (same as the field list above)
+    _struct = struct.Struct('<4L16s16s2L32s32sL')
 
     SHA2 = 1
     RIJNDAEL = 2
@@ -557,27 +749,21 @@ class HeaderStruct(object):
         :returns: Structure encoded as binary string for keepass database.
         :rtype: bytes
         """
-        ret = bytearray()
-        for name, len, typecode in self.format:
-            value = getattr(self, name)
-            buf = struct.pack('<' + typecode, value)
-            ret.extend(buf)
-        return bytes(ret)
+        return self._struct.pack(*[getattr(self, name) for (name, _, _) in self.format])
 
     def decode(self, buf):
         """
         Set object attributes from binary string buffer.
         
+        Only the first :attr:`length` bytes of the buffer are read.
+        
         :param buf: The binary string representation of this struct from database.
         :type buf: bytes 
         """
-        index = 0
         if self.length > len(buf):
             raise exc.ParseError("Insufficient data for reading header.") 
-        for (name, nbytes, typecode) in self.format:
-            string = buf[index:index + nbytes]
-            index += nbytes
-            value = struct.unpack('<' + typecode, string)[0]
+        values = self._struct.unpack_from(buf, 0)
+        for ((name, _, _), value) in zip(self.format, values):
             setattr(self, name, value)
         if const.DB_SIGNATURE1 != self.signature1 or \
                 const.DB_SIGNATURE2 != self.signature2:
@@ -0,0 +1,95 @@
+"""
+Unit tests for the asyncio interface (Python 3.5+).
+"""
+from __future__ import print_function, unicode_literals
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+from keepassdb import Database, LockingDatabase, exc
+from keepassdb.tests import TestBase
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from keepassdb import aio
+
+@unittest.skipIf(sys.version_info < (3, 5), "asyncio interface requires Python 3.5+")
+class AsyncDatabaseTest(TestBase):
+
+    def setUp(self):
+        super(AsyncDatabaseTest, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.tmpdir)
+        super(AsyncDatabaseTest, self).tearDown()
+
+    def test_load_save(self):
+        """ Test loading and saving with the coroutines. """
+        path = os.path.join(self.tmpdir, 'test.kdb')
+        db = Database()
+        db.create_default_group().create_entry(title="FirstEntry", username="root", password="test")
+        db.save(dbfile=path, password='test')
+
+        adb = self.loop.run_until_complete(aio.aopen(path, password='test', semaphore=asyncio.Semaphore(2)))
+        self.assertEquals("FirstEntry", adb.db.entries[0].title)
+        self.assertEquals(path, adb.db.filepath)
+
+        adb.db.entries[0].title = "Changed"
+        self.loop.run_until_complete(adb.asave(password='test'))
+        self.assertEquals("Changed", Database(path, password='test').entries[0].title)
+
+        # A failed load leaves the database alone
+        with self.assertRaises(exc.AuthenticationError):
+            self.loop.run_until_complete(adb.aload(path, password='wrong'))
+        self.assertEquals("Changed", adb.db.entries[0].title)
+
+    def test_failed_save(self):
+        """ Test that a failed save keeps the changes. """
+        adb = aio.AsyncDatabase()
+        adb.db.create_default_group().create_entry(title="FirstEntry", username="root", password="test")
+        path = os.path.join(self.tmpdir, 'missing', 'test.kdb')
+        with self.assertRaises((IOError, OSError)):
+            self.loop.run_until_complete(adb.asave(path, password='test'))
+        self.assertIsNone(adb.db.header)
+        self.assertNotEquals([], adb.db.changes())
+
+    def test_load_locking(self):
+        """ Test that loading keeps the settings and lock of a LockingDatabase. """
+        path = os.path.join(self.tmpdir, 'test.kdb')
+        lockfile = path + '.lock'
+        db = Database()
+        db.create_default_group()
+        db.save(dbfile=path, password='test')
+
+        ldb = LockingDatabase(path, password='test')
+        ldb.save_rounds = 1234
+        adb = aio.AsyncDatabase(ldb)
+        with self.assertRaises(exc.AuthenticationError):
+            self.loop.run_until_complete(adb.aload(path, password='wrong'))
+        self.assertIs(ldb, adb.db)
+        self.assertTrue(os.path.exists(lockfile))
+
+        self.loop.run_until_complete(adb.aload(path, password='test'))
+        self.assertIsNot(ldb, adb.db)
+        self.assertIsInstance(adb.db, LockingDatabase)
+        self.assertEquals(1234, adb.db.save_rounds)
+        self.assertTrue(os.path.exists(lockfile))
+        ldb.close()
+        self.assertTrue(os.path.exists(lockfile))
+        adb.db.close()
+        self.assertFalse(os.path.exists(lockfile))
+
+    def test_timeout(self):
+        """ Test that the timeout includes waiting for the semaphore. """
+        semaphore = asyncio.Semaphore(1)
+        adb = aio.AsyncDatabase(semaphore=semaphore)
+        self.loop.run_until_complete(semaphore.acquire())
+        with self.assertRaises(asyncio.TimeoutError):
+            self.loop.run_until_complete(adb.aload(os.path.join(self.tmpdir, 'missing.kdb'), password='test', timeout=0.01))
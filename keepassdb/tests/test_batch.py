@@ -0,0 +1,53 @@
+"""
+Unit tests for opening/saving databases in worker processes.
+"""
+from __future__ import print_function, unicode_literals
+import os.path
+import shutil
+import tempfile
+
+from keepassdb import Database, exc, batch
+from keepassdb.tests import TestBase
+
+class BatchTest(TestBase):
+
+    def setUp(self):
+        super(BatchTest, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(BatchTest, self).tearDown()
+
+    def test_open_save(self):
+        """ Test opening and saving several databases in worker processes. """
+        items = []
+        for i in range(3):
+            path = os.path.join(self.tmpdir, 'test{0}.kdb'.format(i))
+            db = Database()
+            group = db.create_default_group()
+            group.create_entry(title="Entry {0}".format(i), username="root", password="test")
+            db.save(dbfile=path, password='pass{0}'.format(i))
+            items.append((path, 'pass{0}'.format(i), None))
+
+        dbs = batch.open_databases(items, processes=2)
+        self.assertEquals(["Entry 0", "Entry 1", "Entry 2"], [db.entries[0].title for db in dbs])
+        self.assertIs(dbs[1].groups[0], dbs[1].entries[0].group)
+        self.assertEquals(items[2][0], dbs[2].filepath)
+
+        dbs[1].entries[0].password = "changed"
+        self.assertEquals([None, None], batch.save_databases([(db, None, None, None) for db in dbs[:2]], processes=2))
+        self.assertEquals([], dbs[1].changes())
+        self.assertEquals("changed", Database(items[1][0], password='pass1').entries[0].password)
+
+        # The save_rounds policy of the databases is used by the workers
+        dbs[0].save_rounds = 1234
+        self.assertEquals([None], batch.save_databases([(dbs[0], None, None, None)], processes=1))
+        self.assertEquals(1234, dbs[0].header.key_enc_rounds)
+        self.assertEquals(1234, Database(items[0][0], password='pass0').header.key_enc_rounds)
+
+        results = batch.open_databases([(items[0][0], 'wrong', None), items[2]], processes=2, raise_errors=False)
+        self.assertIsInstance(results[0], exc.AuthenticationError)
+        self.assertEquals("Entry 2", results[1].entries[0].title)
+        with self.assertRaises(exc.AuthenticationError):
+            batch.open_databases([(items[0][0], 'wrong', None)], processes=1)
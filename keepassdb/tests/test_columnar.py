@@ -0,0 +1,62 @@
+"""
+Unit tests for the columnar entry view.
+"""
+from __future__ import print_function, unicode_literals
+from datetime import datetime
+
+from keepassdb import Database
+from keepassdb.columnar import EntryColumns, timestamp, NEVER
+from keepassdb.tests import TestBase
+
+class EntryColumnsTest(TestBase):
+
+    def build_databases(self):
+        db1 = Database()
+        group = db1.create_default_group()
+        group.create_entry(title="Mail", username="root", password="secret",
+                           expires=datetime(2010, 1, 1))
+        group.create_entry(title="Web", username="user", password="other")
+        db2 = Database()
+        group = db2.create_default_group()
+        group.create_entry(title="Shell", username="root", password="secret")
+        return [db1, db2]
+
+    def test_columns(self):
+        """ Test that the columns hold the entry values and strings are interned. """
+        (db1, db2) = dbs = self.build_databases()
+        cols = EntryColumns(dbs)
+        self.assertEquals(3, len(cols))
+        self.assertEquals([0, 0, 1], list(cols.column('database')))
+        self.assertEquals(["Mail", "Web", "Shell"], cols.values('title'))
+        self.assertEquals([timestamp(datetime(2010, 1, 1)), NEVER, NEVER], list(cols.column('expires')))
+        password = cols.column('password')
+        self.assertEquals(password[0], password[2])
+        self.assertEquals(cols.string_id("secret"), password[0])
+        self.assertEquals(db2.entries, cols.entries([2]))
+
+    def test_filter(self):
+        """ Test filtering with predicates over several columns. """
+        cols = EntryColumns(self.build_databases())
+        self.assertEquals([0, 2], cols.filter(username=lambda u: u == "root"))
+        self.assertEquals([2], cols.filter(username=lambda u: u == "root", database=lambda d: d == 1))
+        self.assertEquals([0], cols.expired(datetime(2012, 1, 1)))
+        self.assertEquals([], cols.filter(rows=[1, 2], expires=lambda t: t != NEVER))
+        self.assertEquals([0, 1, 2], cols.older_than(datetime(2999, 1, 1)))
+
+        # String predicates only see the distinct values of the selected rows (once each)
+        seen = []
+        def predicate(u):
+            seen.append(u)
+            return u == "root"
+        self.assertEquals([0, 2], cols.filter(rows=[0, 1, 2], username=predicate))
+        self.assertEquals(["root", "user"], seen)
+        del seen[:]
+        self.assertEquals([], cols.filter(rows=[1], username=predicate))
+        self.assertEquals(["user"], seen)
+
+    def test_duplicates(self):
+        """ Test finding rows that share a value. """
+        cols = EntryColumns(self.build_databases())
+        self.assertEquals([[0, 2]], cols.duplicates())
+        self.assertEquals([[0, 2]], cols.duplicates('username'))
+        self.assertEquals([], cols.duplicates('title'))
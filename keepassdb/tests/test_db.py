@@ -4,9 +4,15 @@ Unit tests for the main Database class.
 from __future__ import print_function, unicode_literals
 
 import os.path
+import logging
+import shutil
+import tempfile
+import unittest
 from io import BytesIO
+from datetime import datetime
 
-from keepassdb import Database, model, exc
+from keepassdb import Database, model, exc, util, const
+from keepassdb.structs import HeaderStruct
 from keepassdb.tests import TestBase, RESOURCES_DIR
 
 class DatabaseTest(TestBase):
@@ -100,4 +106,467 @@ class DatabaseTest(TestBase):
         self.maxDiff = None
         
         self.assertEquals(ser, db.to_dict(hierarchy=True, hide_passwords=True))
-        
\ No newline at end of file
+        
+    
+    def test_save_reuse_transform_seed(self):
+        """ Test saving with the transform seed of the loaded database. """
+        db = Database()
+        db.reuse_transform_seed = True
+        db.create_default_group().create_entry(title="FirstEntry", username="root", password="test")
+        
+        stream = BytesIO()
+        db.save(dbfile=stream, password='test')
+        first = HeaderStruct(stream.getvalue()[:HeaderStruct.length])
+        
+        stream.seek(0)
+        db.load(dbfile=stream, password='test')
+        
+        stream = BytesIO()
+        db.save(dbfile=stream, password='test')
+        second = HeaderStruct(stream.getvalue()[:HeaderStruct.length])
+        
+        self.assertEquals(first.seed_key, second.seed_key)
+        self.assertEquals(first.key_enc_rounds, second.key_enc_rounds)
+        self.assertNotEquals(first.seed_rand, second.seed_rand)
+        self.assertNotEquals(first.encryption_iv, second.encryption_iv)
+        
+        stream.seek(0)
+        db2 = Database(stream, password='test')
+        self.assertEquals(["FirstEntry"], [e.title for e in db2.entries])
+        
+        # Changing the password requires a new transform seed.
+        stream = BytesIO()
+        db.save(dbfile=stream, password='other')
+        third = HeaderStruct(stream.getvalue()[:HeaderStruct.length])
+        self.assertNotEquals(first.seed_key, third.seed_key)
+    
+    def test_save_reuse_transform_seed_keyfile(self):
+        """ Test that the transform seed is reused for the same keyfile contents (not path object). """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            keyfile = os.path.join(tmpdir, 'key')
+            with open(keyfile, 'wb') as fp:
+                fp.write(b'first key')
+            db = Database()
+            db.reuse_transform_seed = True
+            db.create_default_group().create_entry(title="FirstEntry", username="root", password="test")
+            
+            stream = BytesIO()
+            db.save(dbfile=stream, password='test', keyfile=keyfile)
+            first = HeaderStruct(stream.getvalue()[:HeaderStruct.length])
+            stream.seek(0)
+            db.load(dbfile=stream, password='test', keyfile=keyfile)
+            
+            # An equal path (but different string object) still reuses the seed
+            stream = BytesIO()
+            db.save(dbfile=stream, password='test', keyfile=''.join(keyfile))
+            second = HeaderStruct(stream.getvalue()[:HeaderStruct.length])
+            self.assertEquals(first.seed_key, second.seed_key)
+            
+            # Changed keyfile contents do not
+            with open(keyfile, 'wb') as fp:
+                fp.write(b'second key')
+            stream = BytesIO()
+            db.save(dbfile=stream, password='test', keyfile=keyfile)
+            third = HeaderStruct(stream.getvalue()[:HeaderStruct.length])
+            self.assertNotEquals(first.seed_key, third.seed_key)
+            stream.seek(0)
+            self.assertEquals(["FirstEntry"], [e.title for e in Database(stream, password='test', keyfile=keyfile).entries])
+        finally:
+            shutil.rmtree(tmpdir)
+    
+    def test_load_orphaned_entries(self):
+        """ Test that entries without a (valid) group are bound to the first group. """
+        db = Database()
+        i_group = db.create_default_group()
+        e_group = db.create_group(title="eMail")
+        i_group.create_entry(title="FirstEntry", username="root", password="test")
+        orphan = e_group.create_entry(title="Orphan", username="root", password="test")
+        orphan.group_id = 99
+        
+        stream = BytesIO()
+        db.save(dbfile=stream, password='test')
+        stream.seek(0)
+        
+        db = Database(stream, password='test')
+        i_group = self.get_group_by_name(db, 'Internet')
+        self.assertEquals(["FirstEntry", "Orphan"], [e.title for e in i_group.entries])
+        self.assertEquals(i_group.id, self.get_entry_by_name(db, 'Orphan').group_id)
+    
+    def test_lookup(self):
+        """ Test the group/entry lookup methods (and that they follow create/remove/load). """
+        db = Database()
+        i_group = db.create_default_group()
+        e_group = db.create_group(title="eMail", parent=i_group)
+        e1 = i_group.create_entry(title="FirstEntry", username="root", password="test")
+        e2 = e_group.create_entry(title="SecondEntry", username="root", password="test")
+        
+        self.assertIs(i_group, db.get_group(i_group.id))
+        self.assertIs(e_group, db.get_group(e_group.id))
+        self.assertIs(e2, db.get_entry(e2.uuid))
+        self.assertEquals([e1], db.find_entries(title="FirstEntry"))
+        self.assertEquals([e1, e2], db.find_entries(username="root"))
+        self.assertEquals([e_group], db.find_groups(title="eMail"))
+        
+        stream = BytesIO()
+        db.save(dbfile=stream, password='test')
+        stream.seek(0)
+        db = Database(stream, password='test')
+        
+        e_group = db.get_group(e_group.id)
+        self.assertEquals("eMail", e_group.title)
+        self.assertEquals("SecondEntry", db.get_entry(e2.uuid).title)
+        
+        db.remove_group(e_group)
+        self.assertIsNone(db.get_group(e_group.id))
+        self.assertIsNone(db.get_entry(e2.uuid))
+        self.assertEquals("FirstEntry", db.get_entry(e1.uuid).title)
+    
+    def test_bulk_create_remove(self):
+        """ Test creating and removing entries/groups in bulk. """
+        db = Database()
+        i_group = db.create_default_group()
+        sub_group = db.create_group(title="Sub", parent=i_group)
+        e_group = db.create_group(title="eMail")
+        
+        entries = db.create_entries(i_group, [dict(title="Entry {0}".format(i), username="root")
+                                              for i in range(5)])
+        sub_entry = sub_group.create_entry(title="SubEntry")
+        e_entry = e_group.create_entry(title="eMailEntry")
+        
+        self.assertEquals(["Entry {0}".format(i) for i in range(5)], [e.title for e in i_group.entries])
+        self.assertEquals(7, len(db.entries))
+        self.assertIs(entries[2], db.get_entry(entries[2].uuid))
+        
+        db.remove_entries([entries[0], entries[3], e_entry])
+        self.assertEquals(["Entry 1", "Entry 2", "Entry 4"], [e.title for e in i_group.entries])
+        self.assertEquals([], e_group.entries)
+        self.assertEquals(["Entry 1", "Entry 2", "Entry 4", "SubEntry"], [e.title for e in db.entries])
+        self.assertIsNone(db.get_entry(entries[0].uuid))
+        
+        db.remove_groups([i_group])
+        self.assertEquals([e_group], db.groups)
+        self.assertEquals([e_group], db.root.children)
+        self.assertEquals([], db.entries)
+        self.assertIsNone(db.get_group(sub_group.id))
+        self.assertIsNone(db.get_entry(sub_entry.uuid))
+    
+    def test_save_stream_chunks(self):
+        """ Test saving in small chunks to seekable and non-seekable streams. """
+        
+        class WriteOnlyStream(object):
+            def __init__(self):
+                self.buf = BytesIO()
+            def write(self, data):
+                self.buf.write(data)
+        
+        db = Database()
+        db.save_chunk_size = 100
+        i_group = db.create_default_group()
+        db.create_entries(i_group, [dict(title="Entry {0}".format(i), username="root", password="test")
+                                    for i in range(20)])
+        ser = db.to_dict(hierarchy=True, hide_passwords=True)
+        
+        stream = BytesIO()
+        stream.write(b'prefix')
+        db.save(dbfile=stream, password='test')
+        stream.seek(len(b'prefix'))
+        self.assertEquals(ser, Database(stream, password='test').to_dict(hierarchy=True, hide_passwords=True))
+        
+        write_only = WriteOnlyStream()
+        db.save(dbfile=write_only, password='test')
+        write_only.buf.seek(0)
+        self.assertEquals(ser, Database(write_only.buf, password='test').to_dict(hierarchy=True, hide_passwords=True))
+    
+    def test_iterload(self):
+        """ Test loading incrementally from a stream. """
+        db = Database()
+        i_group = db.create_default_group()
+        e_group = db.create_group(title="eMail")
+        db.create_entries(i_group, [dict(title="Entry {0}".format(i), username="root", password="test")
+                                    for i in range(10)])
+        e_group.create_entry(title="ThirdEntry", username="root", password="test")
+        ser = db.to_dict(hierarchy=True, hide_passwords=True)
+        
+        stream = BytesIO()
+        db.save(dbfile=stream, password='test')
+        
+        stream.seek(0)
+        db = Database()
+        loaded = [obj.title for obj in db.iterload(stream, password='test', chunk_size=7)]
+        self.assertEquals(["Internet", "eMail"] + ["Entry {0}".format(i) for i in range(10)] + ["ThirdEntry"], loaded)
+        self.assertEquals(ser, db.to_dict(hierarchy=True, hide_passwords=True))
+        
+        stream.seek(0)
+        db = Database()
+        with self.assertRaises((exc.AuthenticationError, exc.IncorrectKey)):
+            for obj in db.iterload(stream, password='wrong'):
+                pass
+        self.assertEquals([], db.groups)
+        self.assertEquals([], db.entries)
+    
+    def test_load_mmap(self):
+        """ Test loading a memory-mapped file. """
+        db = Database()
+        db.create_default_group().create_entry(title="FirstEntry", username="root", password="test")
+        ser = db.to_dict(hierarchy=True, hide_passwords=True)
+        
+        tmpdir = tempfile.mkdtemp()
+        try:
+            kdb = os.path.join(tmpdir, 'test.kdb')
+            db.save(kdb, password='test')
+            
+            db = Database()
+            db.load(kdb, password='test', use_mmap=True)
+            self.assertEquals(kdb, db.filepath)
+            self.assertEquals(ser, db.to_dict(hierarchy=True, hide_passwords=True))
+            
+            # The map is closed (not left to the garbage collector) when loading fails
+            warnings = []
+            class Handler(logging.Handler):
+                def emit(self, record):
+                    warnings.append(record.getMessage())
+            handler = Handler(logging.WARNING)
+            logging.getLogger('keepassdb').addHandler(handler)
+            try:
+                with self.assertRaises(exc.AuthenticationError):
+                    Database().load(kdb, password='wrong', use_mmap=True)
+            finally:
+                logging.getLogger('keepassdb').removeHandler(handler)
+            self.assertEquals([], warnings)
+        finally:
+            shutil.rmtree(tmpdir)
+    
+    def test_compact_model(self):
+        """ Test creating and loading with the compact (__slots__) model classes. """
+        db = Database()
+        db.group_class = model.CompactGroup
+        db.entry_class = model.CompactEntry
+        i_group = db.create_default_group()
+        entry = i_group.create_entry(title="FirstEntry", username="root", password="test")
+        self.assertIsInstance(i_group, model.Group)
+        self.assertIsInstance(entry, model.Entry)
+        self.assertFalse(hasattr(entry, '__dict__'))
+        ser = db.to_dict(hierarchy=True)
+        
+        stream = BytesIO()
+        db.save(dbfile=stream, password='test')
+        stream.seek(0)
+        
+        db2 = Database()
+        db2.group_class = model.CompactGroup
+        db2.entry_class = model.CompactEntry
+        db2.load(stream, password='test')
+        self.assertIsInstance(db2.groups[0], model.CompactGroup)
+        self.assertIsInstance(db2.entries[0], model.CompactEntry)
+        self.assertEquals(ser, db2.to_dict(hierarchy=True))
+        
+        db2.entries[0].move(db2.create_group(title="eMail"))
+        self.assertEquals("eMail", db2.entries[0].group.title)
+    
+    def test_changes(self):
+        """ Test dirty flags and the change journal. """
+        db = Database()
+        i_group = db.create_default_group()
+        entry1 = i_group.create_entry(title="First", username="root", password="test")
+        entry2 = i_group.create_entry(title="Second", username="root", password="test")
+        self.assertEquals([('created', i_group), ('created', entry1), ('created', entry2)], db.changes())
+        
+        stream = BytesIO()
+        db.save(dbfile=stream, password='test')
+        self.assertEquals([], db.changes())
+        self.assertFalse(entry1.dirty)
+        
+        stream.seek(0)
+        db.load(stream, password='test')
+        self.assertEquals([], db.changes())
+        (entry1, entry2) = db.entries
+        entry1.title = "Changed"
+        db.remove_entry(entry2)
+        e_group = db.create_group(title="eMail")
+        self.assertEquals([('created', e_group), ('modified', entry1), ('removed', entry2)], db.changes())
+        
+        # Removing a new group leaves no trace
+        e_group.remove()
+        self.assertEquals([('modified', entry1), ('removed', entry2)], db.changes())
+    
+    def test_changes_plain_attributes(self):
+        """ Test that assigning attributes that are not properties marks the objects dirty. """
+        db = Database()
+        db.create_default_group().create_entry(title="First", username="root", password="test")
+        stream = BytesIO()
+        db.save(dbfile=stream, password='test')
+        
+        accessed = datetime(2001, 1, 1)
+        for (group_class, entry_class, lazy) in ((model.Group, model.Entry, False),
+                                                 (model.CompactGroup, model.CompactEntry, False),
+                                                 (model.Group, model.Entry, True)):
+            stream.seek(0)
+            db = Database()
+            (db.group_class, db.entry_class, db.lazy_entries) = (group_class, entry_class, lazy)
+            db.load(stream, password='test')
+            (group, entry) = (db.groups[0], db.entries[0])
+            self.assertEquals("First", entry.title) # (Decoding a lazy entry is not a change.)
+            self.assertEquals([], db.changes())
+            
+            entry.accessed = accessed
+            group.flags = 7
+            self.assertEquals([('modified', group), ('modified', entry)], db.changes())
+            
+            out = BytesIO()
+            db.save(dbfile=out, password='test')
+            out.seek(0)
+            db2 = Database(out, password='test')
+            self.assertEquals(accessed, db2.entries[0].accessed)
+            self.assertEquals(7, db2.groups[0].flags)
+    
+    def test_save_cached_encoded(self):
+        """ Test that unchanged groups/entries are saved from their cached encoded bytes. """
+        db = Database()
+        i_group = db.create_default_group()
+        i_group.create_entry(title="First", username="root", password="test")
+        i_group.create_entry(title="Second", username="root", password="test", binary=b'\x00\x01')
+        stream = BytesIO()
+        db.save(dbfile=stream, password='test')
+        
+        for lazy in (False, True):
+            stream.seek(0)
+            db = Database()
+            db.lazy_entries = lazy
+            db.load(stream, password='test')
+            (entry1, entry2) = db.entries
+            def fail():
+                raise AssertionError("Unchanged object was encoded again.")
+            db.groups[0].to_struct = fail
+            entry1.to_struct = fail
+            entry2.binary = b'\x02'
+            
+            out = BytesIO()
+            db.save(dbfile=out, password='test')
+            out.seek(0)
+            db2 = Database(out, password='test')
+            self.assertEquals("First", db2.entries[0].title)
+            self.assertEquals(b'\x02', db2.entries[1].binary)
+    
+    def test_debug_logging_secrets(self):
+        """ Test that passwords and keys are not logged (even at debug level). """
+        messages = []
+        class Handler(logging.Handler):
+            def emit(self, record):
+                messages.append(record.getMessage())
+        handler = Handler()
+        log = logging.getLogger('keepassdb')
+        level = log.level
+        log.setLevel(logging.DEBUG)
+        log.addHandler(handler)
+        try:
+            db = Database()
+            i_group = db.create_default_group()
+            i_group.create_entry(title="FirstEntry", username="root", password="s3cr3t")
+            stream = BytesIO()
+            db.save(dbfile=stream, password='masterpass')
+            stream.seek(0)
+            db.load(stream, password='masterpass')
+        finally:
+            log.removeHandler(handler)
+            log.setLevel(level)
+        self.assertTrue(messages)
+        for message in messages:
+            self.assertNotIn('s3cr3t', message)
+            self.assertNotIn('masterpass', message)
+    
+    def test_early_key_rejection(self):
+        """ Test that invalid padding is detected before decrypting all content. """
+        db = Database()
+        db.create_default_group().create_entry(title="FirstEntry", username="root", password="test")
+        stream = BytesIO()
+        db.save(dbfile=stream, password='test')
+        # Flipping a bit of the second to last block flips the same bit of the padding.
+        data = bytearray(stream.getvalue())
+        data[-17] ^= 0x20
+        data = bytes(data)
+        
+        decrypt = util.decrypt_aes_cbc
+        def fail(*args, **kwargs):
+            raise AssertionError("Content was decrypted.")
+        util.decrypt_aes_cbc = fail
+        try:
+            with self.assertRaises(exc.AuthenticationError):
+                Database().load_from_buffer(data, password='test')
+        finally:
+            util.decrypt_aes_cbc = decrypt
+        
+        with self.assertRaises(exc.AuthenticationError):
+            next(Database().iterload(BytesIO(data), password='test'))
+    
+    def test_save_rounds(self):
+        """ Test the key transformation rounds policies for saving. """
+        db = Database()
+        db.create_default_group()
+        db.save_rounds = 1234
+        stream = BytesIO()
+        db.save(dbfile=stream, password='test')
+        
+        stream.seek(0)
+        db = Database(stream, password='test')
+        self.assertEquals(1234, db.header.key_enc_rounds)
+        # Preserve the loaded rounds (by default)
+        stream = BytesIO()
+        db.save(dbfile=stream, password='test')
+        self.assertEquals(1234, HeaderStruct(stream.getvalue()).key_enc_rounds)
+        
+        db = Database()
+        db.create_default_group()
+        db.save(dbfile=BytesIO(), password='test')
+        self.assertEquals(const.DB_DEFAULT_KEY_ENC_ROUNDS, db.header.key_enc_rounds)
+        
+        db.save_rounds = 'calibrate'
+        db.calibrate_seconds = 0.01
+        db.save(dbfile=BytesIO(), password='test')
+        self.assertTrue(db.header.key_enc_rounds >= 1)
+        
+        db.save_rounds = 'fast'
+        with self.assertRaises(ValueError):
+            db.save(dbfile=BytesIO(), password='test')
+    
+    def test_failed_save_keeps_file(self):
+        """ Test that a save that fails while serializing leaves the existing file intact. """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'test.kdb')
+            db = Database()
+            db.create_default_group().create_entry(title="FirstEntry", username="root", password="test")
+            db.save(path, password='test')
+            
+            entry = db.entries[0]
+            entry._icon = 'notanint'
+            entry.dirty = True
+            with self.assertRaises(Exception):
+                db.save(path, password='test')
+            
+            self.assertEquals("FirstEntry", Database(path, password='test').entries[0].title)
+            self.assertEquals(['test.kdb'], os.listdir(tmpdir))
+        finally:
+            shutil.rmtree(tmpdir)
+    
+    @unittest.skipUnless(hasattr(os, 'symlink'), "requires symlinks")
+    def test_save_symlink(self):
+        """ Test that saving through a symlink replaces the target and that new files get the umask mode. """
+        tmpdir = tempfile.mkdtemp()
+        umask = os.umask(0o022)
+        try:
+            path = os.path.join(tmpdir, 'real.kdb')
+            link = os.path.join(tmpdir, 'link.kdb')
+            db = Database()
+            db.create_default_group().create_entry(title="FirstEntry", username="root", password="test")
+            db.save(path, password='test')
+            self.assertEquals(0o644, os.stat(path).st_mode & 0o777)
+            
+            os.symlink(path, link)
+            db.entries[0].title = "Changed"
+            db.save(link, password='test')
+            self.assertTrue(os.path.islink(link))
+            self.assertEquals("Changed", Database(path, password='test').entries[0].title)
+        finally:
+            os.umask(umask)
+            shutil.rmtree(tmpdir)
@@ -3,8 +3,9 @@ Unit tests for group-related operations.
 """
 from __future__ import print_function, unicode_literals
 import os.path
+from io import BytesIO
 
-from keepassdb import Database
+from keepassdb import Database, model
 from keepassdb.tests import TestBase, RESOURCES_DIR
 
 class EntryTest(TestBase):
@@ -60,3 +61,46 @@ class EntryTest(TestBase):
         entry.move(entry.group, 1)
         
         self.assertEquals(["AEntry1", "AEntry2", "AEntry3"], [e.title for e in new_parent.entries])
+    
+    def test_lazy_entries(self):
+        """ Test loading entries that decode their fields on access. """
+        db = Database()
+        group = db.create_default_group()
+        group.create_entry(title="FirstEntry", username="root", password="test", notes="Notes",
+                           binary_desc="file.bin", binary=b"\x00\x01")
+        group.create_entry(title="SecondEntry", username="user")
+        
+        stream = BytesIO()
+        db.save(dbfile=stream, password='test')
+        stream.seek(0)
+        ser = Database(stream, password='test').to_dict(hierarchy=True)
+        
+        stream.seek(0)
+        db = Database()
+        db.lazy_entries = True
+        db.load(stream, password='test')
+        
+        entry = db.entries[0]
+        self.assertIsInstance(entry, model.LazyEntry)
+        self.assertEquals(group.id, entry.group.id)
+        self.assertNotIn('_password', entry.__dict__)
+        self.assertEquals("test", entry.password)
+        self.assertIn('_password', entry.__dict__)
+        self.assertEquals(b"\x00\x01", entry.binary)
+        self.assertEquals(ser, db.to_dict(hierarchy=True))
+        
+        entry.title = "Changed"
+        stream = BytesIO()
+        db.save(dbfile=stream, password='test')
+        stream.seek(0)
+        db = Database(stream, password='test')
+        self.assertEquals(["Changed", "SecondEntry"], [e.title for e in db.entries])
+
+        
+        # LazyEntry cannot be combined with another entry class
+        stream.seek(0)
+        db = Database()
+        db.lazy_entries = True
+        db.entry_class = model.CompactEntry
+        with self.assertRaises(ValueError):
+            db.load(stream, password='test')
@@ -47,4 +47,19 @@ class GroupTest(TestBase):
         
         self.assertEquals(['C1', 'A1', 'B1'], [g.title for g in i_g.children])
     
-    
\ No newline at end of file
+    def test_create_ids(self):
+        """ Test ids assigned to new groups. """
+        db = Database()
+        groups = [db.create_group(title="Group {0}".format(i)) for i in range(5)]
+        self.assertEquals([1, 2, 3, 4, 5], [g.id for g in groups])
+        
+        db.remove_group(groups[1])
+        self.assertEquals(6, db.create_group(title="New").id)
+        
+        db.reuse_group_ids = True
+        db.remove_group(groups[3])
+        db.remove_group(groups[2])
+        self.assertEquals(3, db.create_group(title="Reused").id)
+        self.assertEquals(4, db.create_group(title="Reused").id)
+        self.assertEquals(7, db.create_group(title="New").id)
+
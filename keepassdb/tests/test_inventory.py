@@ -0,0 +1,77 @@
+"""
+Unit tests for the header-only inventory functions.
+"""
+from __future__ import print_function, unicode_literals
+import os.path
+import shutil
+import tempfile
+from io import BytesIO
+
+from keepassdb import Database, exc, inventory
+from keepassdb.tests import TestBase
+
+class InventoryTest(TestBase):
+
+    def setUp(self):
+        super(InventoryTest, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(InventoryTest, self).tearDown()
+
+    def create_db(self, path, nentries):
+        db = Database()
+        group = db.create_default_group()
+        for i in range(nentries):
+            group.create_entry(title="Entry {0}".format(i), username="root", password="test")
+        db.save(dbfile=path, password='test')
+
+    def test_probe(self):
+        """ Test reading the header without password. """
+        path = os.path.join(self.tmpdir, 'test.kdb')
+        self.create_db(path, 2)
+        info = inventory.probe(path)
+        self.assertEquals(1, info.ngroups)
+        self.assertEquals(2, info.nentries)
+        self.assertEquals(50000, info.key_enc_rounds)
+        with open(path, 'rb') as fp:
+            self.assertEquals(info, inventory.probe(fp))
+
+        with self.assertRaises(exc.InvalidDatabase):
+            inventory.probe(BytesIO(b'\0' * 124))
+        with self.assertRaises(exc.ParseError):
+            inventory.probe(BytesIO(b'\0' * 10))
+        with self.assertRaises(exc.ParseError):
+            inventory.probe(BytesIO(b''))
+
+    def test_scan(self):
+        """ Test scanning a directory tree and reusing the sidecar index. """
+        os.mkdir(os.path.join(self.tmpdir, 'sub'))
+        path1 = os.path.join(self.tmpdir, 'one.kdb')
+        path2 = os.path.join(self.tmpdir, 'sub', 'two.kdb')
+        self.create_db(path1, 1)
+        self.create_db(path2, 3)
+        with open(os.path.join(self.tmpdir, 'bogus.kdb'), 'wb') as fp:
+            fp.write(b'not a database')
+        open(os.path.join(self.tmpdir, 'empty.kdb'), 'wb').close()
+        index_path = os.path.join(self.tmpdir, 'index.json')
+
+        result = inventory.Inventory(index_path=index_path, workers=2).scan(self.tmpdir)
+        self.assertEquals(set([path1, path2]), set(result))
+        self.assertEquals(3, result[path2].nentries)
+        self.assertTrue(os.path.exists(index_path))
+        self.assertEquals(['bogus.kdb', 'empty.kdb', 'index.json', 'one.kdb', 'sub'], sorted(os.listdir(self.tmpdir)))
+
+        # Unchanged files are not read again
+        probe = inventory.probe
+        def fail(path):
+            raise AssertionError("File read again: {0}".format(path))
+        inventory.probe = fail
+        try:
+            self.assertEquals(result, inventory.Inventory(index_path=index_path).scan(self.tmpdir))
+        finally:
+            inventory.probe = probe
+
+        os.remove(path1)
+        self.assertEquals([path2], list(inventory.Inventory(index_path=index_path).scan(self.tmpdir)))
@@ -0,0 +1,83 @@
+"""
+Unit tests for the struct parsing/encoding.
+"""
+from __future__ import print_function, unicode_literals
+
+import struct
+from datetime import datetime
+
+from keepassdb import const
+from keepassdb.structs import GroupStruct, EntryStruct, MarshallDate, NEVER_BYTES
+from keepassdb.tests import TestBase
+
+class StructTest(TestBase):
+    
+    def make_entry_struct(self, title):
+        estruct = EntryStruct()
+        estruct.uuid = b'00112233445566778899aabbccddeeff'
+        estruct.group_id = 1
+        estruct.icon = 1
+        estruct.title = title
+        estruct.url = ''
+        estruct.username = 'root'
+        estruct.password = 'secret'
+        estruct.notes = ''
+        estruct.created = const.NEVER
+        estruct.modified = const.NEVER
+        estruct.accessed = const.NEVER
+        estruct.expires = const.NEVER
+        estruct.binary_desc = ''
+        estruct.binary = b''
+        return estruct
+    
+    def test_decode_offset(self):
+        """ Test decoding consecutive structs from a shared buffer. """
+        gstruct = GroupStruct()
+        gstruct.id = 1
+        gstruct.title = 'Internet'
+        gstruct.icon = 1
+        gstruct.level = 0
+        gstruct.created = gstruct.modified = gstruct.accessed = gstruct.expires = const.NEVER
+        gstruct.flags = 0
+        
+        buf = bytes(gstruct.encode() + self.make_entry_struct('First').encode() + self.make_entry_struct('Second').encode())
+        
+        decoded = GroupStruct()
+        offset = decoded.decode(buf, 0)
+        self.assertEquals(len(decoded), offset)
+        self.assertEquals(gstruct.attributes(), decoded.attributes())
+        
+        titles = []
+        while offset < len(buf):
+            estruct = EntryStruct()
+            offset = estruct.decode(buf, offset)
+            titles.append(estruct.title)
+        
+        self.assertEquals(['First', 'Second'], titles)
+        self.assertEquals(len(buf), offset)
+
+class MarshallDateTest(TestBase):
+    
+    def test_roundtrip(self):
+        """ Test encoding and decoding dates (cached and uncached). """
+        marshall = MarshallDate()
+        dates = [datetime(2012, 12, 20, 20, 56, 56), datetime(1999, 1, 1, 0, 0, 0), const.NEVER]
+        for dt in dates:
+            buf = marshall.encode(dt)
+            self.assertEquals(marshall._encode(dt), buf)
+            self.assertEquals(dt, marshall.decode(buf))
+            self.assertEquals(dt, marshall._decode(buf))
+        
+        self.assertEquals(dates, marshall.decode_many([marshall.encode(dt) for dt in dates]))
+        self.assertEquals(dates * 2, marshall.decode_many([marshall.encode(dt) for dt in dates * 2]))
+        self.assertEquals([], marshall.decode_many([]))
+        with self.assertRaises(struct.error):
+            marshall.decode_many([NEVER_BYTES, b'\0' * 4])
+        self.assertIs(const.NEVER, marshall.decode(NEVER_BYTES))
+    
+    def test_cache_bounded(self):
+        """ Test that the decode cache does not grow beyond cache_size. """
+        marshall = MarshallDate()
+        for minute in range(60):
+            marshall.decode(marshall._encode(datetime(2000, 1, 1, 0, minute, 0)))
+        self.assertTrue(len(MarshallDate._decode_cache) <= MarshallDate.cache_size)
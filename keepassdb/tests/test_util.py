@@ -0,0 +1,155 @@
+"""
+Unit tests for the utility functions.
+"""
+from __future__ import print_function
+import hashlib
+from datetime import datetime
+
+from Crypto.Cipher import AES
+
+from keepassdb import util, model
+from keepassdb.tests import TestBase
+
+class TransformKeyTest(TestBase):
+    
+    startkey = hashlib.sha256(b'test').digest()
+    seed_key = hashlib.sha256(b'seed').digest()
+    seed_rand = b'\x05' * 16
+    
+    def test_backends_match_reference(self):
+        """ Test that transform backends produce the same keys as the reference implementation. """
+        chunk = util.TRANSFORM_CHUNK_BLOCKS
+        for rounds in (0, 1, 2, 1000, chunk, chunk + 1, 2 * chunk + 3):
+            expected = util.transform_rounds_python(self.startkey, self.seed_key, rounds)
+            for (name, func) in util.TRANSFORM_BACKENDS:
+                self.assertEquals(expected, func(self.startkey, self.seed_key, rounds),
+                                  "backend {0} differs for {1} rounds".format(name, rounds))
+    
+    def test_default_backend(self):
+        """ Test that the fastest backend is selected automatically. """
+        (name, func) = util.get_transform_backend()
+        self.assertEquals('cbc', name)
+        self.assertEquals(util.transform_key(self.startkey, self.seed_key, self.seed_rand, 500,
+                                             backend=util.transform_rounds_python),
+                          util.transform_key(self.startkey, self.seed_key, self.seed_rand, 500))
+
+class KeyCacheTest(TestBase):
+    
+    def test_derive_key_cached(self):
+        """ Test that derive_key() stores and reuses keys from the cache. """
+        cache = util.KeyCache(maxsize=2)
+        args = dict(seed_key=b'\x01' * 32, seed_rand=b'\x02' * 16, rounds=100, password='test')
+        key = util.derive_key(cache=cache, **args)
+        self.assertEquals(1, len(cache))
+        self.assertEquals(key, util.derive_key(cache=cache, **args))
+        self.assertEquals(key, util.derive_key(**args))
+        self.assertEquals(1, len(cache))
+    
+    def test_lru_eviction(self):
+        """ Test that least-recently-used keys are evicted (and wiped). """
+        cache = util.KeyCache(maxsize=2)
+        cache.put(b'a', b's', b'r', 1, b'key-a')
+        cache.put(b'b', b's', b'r', 1, b'key-b')
+        self.assertEquals(b'key-a', cache.get(b'a', b's', b'r', 1))
+        wiped = cache._entries[cache._lookup_key(b'b', b's', b'r', 1)][1]
+        cache.put(b'c', b's', b'r', 1, b'key-c')
+        self.assertIsNone(cache.get(b'b', b's', b'r', 1))
+        self.assertEquals(bytearray(5), wiped)
+        self.assertEquals(b'key-a', cache.get(b'a', b's', b'r', 1))
+        self.assertEquals(b'key-c', cache.get(b'c', b's', b'r', 1))
+    
+    def test_ttl_expiry(self):
+        """ Test that expired keys are not returned. """
+        clock = [100.0]
+        cache = util.KeyCache(ttl=10, timer=lambda: clock[0])
+        cache.put(b'a', b's', b'r', 1, b'key-a')
+        clock[0] += 5
+        self.assertEquals(b'key-a', cache.get(b'a', b's', b'r', 1))
+        clock[0] += 6
+        self.assertIsNone(cache.get(b'a', b's', b'r', 1))
+        self.assertEquals(0, len(cache))
+
+class CbcEncryptorTest(TestBase):
+    
+    def test_incremental_encrypt(self):
+        """ Test that incremental encryption matches encrypting everything at once. """
+        key = b'\x01' * 32
+        iv = b'\x02' * 16
+        for length in (0, 1, 15, 16, 17, 100):
+            cleartext = bytes(bytearray(range(length)))
+            expected = util.encrypt_aes_cbc(cleartext, key, iv)
+            for step in (1, 7, 16, 33):
+                encryptor = util.CbcEncryptor(key, iv)
+                ciphertext = b''.join([encryptor.update(cleartext[i:i + step]) for i in range(0, length, step)])
+                ciphertext += encryptor.finalize()
+                self.assertEquals(expected, ciphertext)
+                self.assertEquals(cleartext, util.decrypt_aes_cbc(ciphertext, key, iv))
+                
+                decryptor = util.CbcDecryptor(key, iv)
+                decrypted = b''.join([decryptor.update(ciphertext[i:i + step]) for i in range(0, len(ciphertext), step)])
+                decrypted += decryptor.finalize()
+                self.assertEquals(cleartext, decrypted)
+            
+            self.assertEquals(cleartext, util.decrypt_aes_cbc(bytearray(ciphertext), key, iv))
+            self.assertEquals(cleartext, util.decrypt_aes_cbc(memoryview(ciphertext), key, iv))
+
+class ClockTest(TestBase):
+    
+    def test_frozen(self):
+        """ Test that frozen time is used by the model. """
+        when = datetime(2012, 3, 4, 5, 6, 7, 890)
+        with util.clock.frozen(when):
+            self.assertEquals(when.replace(microsecond=0), util.now())
+            group = model.Group(title="Test")
+            self.assertEquals(util.now(), group.created)
+            self.assertEquals(util.now(), group.accessed)
+        self.assertNotEqual(when.replace(microsecond=0), util.now())
+    
+    def test_batch(self):
+        """ Test that a batch shares one timestamp (also when nested). """
+        ticks = [datetime(2012, 1, 1, 0, 0, 0)]
+        def source():
+            ticks[0] = ticks[0].replace(second=ticks[0].second + 1)
+            return ticks[0]
+        clock = util.Clock(source)
+        self.assertNotEqual(clock.now(), clock.now())
+        with clock.batch() as now:
+            self.assertEquals(now, clock.now())
+            with clock.batch() as inner:
+                self.assertEquals(now, inner)
+            self.assertEquals(now, clock.now())
+        self.assertNotEqual(now, clock.now())
+
+class FinalPaddingTest(TestBase):
+    
+    key = b'\x01' * 32
+    iv = b'\x02' * 16
+    
+    def test_valid(self):
+        """ Test that correctly padded content passes the check. """
+        for length in (0, 1, 15, 16, 17, 100):
+            ciphertext = util.encrypt_aes_cbc(b'\x03' * length, self.key, self.iv)
+            self.assertTrue(util.final_padding_valid(ciphertext, self.key, self.iv))
+            self.assertTrue(util.final_padding_valid(bytearray(ciphertext), self.key, self.iv))
+    
+    def test_invalid(self):
+        """ Test that invalid padding is detected. """
+        for cleartext in (b'\x00' * 16, b'\x00' * 31 + b'\x11', b'\x00' * 30 + b'\x01\x02', b'\x00' * 44 + b'\x04\x04\x03\x04'):
+            ciphertext = AES.new(self.key, AES.MODE_CBC, self.iv).encrypt(cleartext)
+            self.assertFalse(util.final_padding_valid(ciphertext, self.key, self.iv))
+
+class CalibrateRoundsTest(TestBase):
+    
+    def test_calibrate(self):
+        """ Test that the rounds are extrapolated from a timed run. """
+        clock = [0.0]
+        def timer():
+            return clock[0]
+        def backend(startkey, seed_key, rounds):
+            clock[0] += rounds * 1e-6 # 1 million rounds per second
+            return startkey
+        rounds = util.calibrate_rounds(2.0, backend=backend, timer=timer)
+        self.assertAlmostEqual(2000000, rounds, delta=1)
+        self.assertAlmostEqual(500, util.calibrate_rounds(0.0005, backend=backend, timer=timer), delta=1)
+        with self.assertRaises(ValueError):
+            util.calibrate_rounds(0)
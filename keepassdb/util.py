@@ -12,16 +12,74 @@ You should have received a copy of the GNU General Public License along with
 keepassdb.  If not, see <http://www.gnu.org/licenses/>.
 """
 import struct
+import time
+import threading
 from datetime import datetime
+from collections import OrderedDict
 import hashlib
+import heapq
+import logging
+from contextlib import contextmanager
 
 from Crypto.Cipher import AES
 from Crypto.Hash import SHA256
 
-def derive_key(seed_key, seed_rand, rounds, password=None, keyfile=None):
+from keepassdb import exc, const
+
+class ClassLogger(object):
+    """
+    Descriptor that provides a logger per (model/struct) class, shared by all instances of the class.
+    """
+    
+    def __init__(self):
+        self._loggers = {}
+    
+    def __get__(self, obj, cls):
+        try:
+            return self._loggers[cls]
+        except KeyError:
+            log = logging.getLogger('{0}.{1}'.format(cls.__module__, cls.__name__))
+            self._loggers[cls] = log
+            return log
+
+def derive_key(seed_key, seed_rand, rounds, password=None, keyfile=None, cache=None):
     """
     Derives the correct (final) master key from the password and/or keyfile and
     sepcified transform seed & num rounds.
+    
+    :param cache: Optional cache of previously derived keys.
+    :type cache: :class:`KeyCache`
+    """
+    masterkey = composite_key(password=password, keyfile=keyfile)
+
+    # Create the key that is needed to...
+    if cache is None:
+        return transform_key(masterkey, seed_key=seed_key, seed_rand=seed_rand, rounds=rounds)
+    
+    final_key = cache.get(masterkey, seed_key, seed_rand, rounds)
+    if final_key is None:
+        final_key = transform_key(masterkey, seed_key=seed_key, seed_rand=seed_rand, rounds=rounds)
+        cache.put(masterkey, seed_key, seed_rand, rounds, final_key)
+    
+    return final_key
+
+def derive_transformed_key(seed_key, rounds, password=None, keyfile=None):
+    """
+    Derives the transformed master key (the expensive part of :func:`derive_key`) from the
+    password and/or keyfile and specified transform seed & num rounds.
+    
+    The final key can be computed from the result for any random seed using :func:`finalize_key`.
+    
+    :rtype: bytes
+    """
+    masterkey = composite_key(password=password, keyfile=keyfile)
+    return transform_master_key(masterkey, seed_key=seed_key, rounds=rounds)
+
+def composite_key(password=None, keyfile=None):
+    """
+    Returns the (untransformed) master key for the password and/or keyfile.
+    
+    :rtype: bytes
     """
     if password == '': password = None
     if keyfile == '': keyfile = None
@@ -38,11 +96,8 @@ def derive_key(seed_key, seed_rand, rounds, password=None, keyfile=None):
         masterkey = sha.digest()
     else:
         masterkey = key_from_password(password)
-
-    # Create the key that is needed to...
-    final_key = transform_key(masterkey, seed_key=seed_key, seed_rand=seed_rand, rounds=rounds)
     
-    return final_key
+    return masterkey
     
 def key_from_keyfile(keyfile):
     """
@@ -88,9 +143,22 @@ def key_from_password(password):
     return sha.digest()
 
 
-def transform_key(startkey, seed_key, seed_rand, rounds):
+# Number of 16-byte blocks handed to the cipher per call by the CBC transform backend.
+TRANSFORM_CHUNK_BLOCKS = 8192
+
+def transform_rounds_python(startkey, seed_key, rounds):
     """
-    This method creates the key to decrypt the database.
+    Reference implementation of the key transformation rounds.
+    
+    Encrypts the key with AES-ECB once per round from python.  This is slow, but
+    it is the most literal translation of the KeePass algorithm and is kept as a
+    fallback (and for verifying the other backends).
+    
+    :param startkey: The 32-byte (composite) master key.
+    :param seed_key: The 32-byte transform seed from the header.
+    :param rounds: The number of transformation rounds.
+    :returns: The 32-byte key after `rounds` encryptions.
+    :rtype: bytes
     """
     masterkey = startkey
     aes = AES.new(seed_key, AES.MODE_ECB)
@@ -98,20 +166,289 @@ def transform_key(startkey, seed_key, seed_rand, rounds):
     # Encrypt the created hash <rounds> times
     for _i in range(rounds):
         masterkey = aes.encrypt(masterkey)
+    
+    return masterkey
+
+def transform_rounds_cbc(startkey, seed_key, rounds):
+    """
+    Key transformation rounds executed inside the cipher implementation.
+    
+    Each 16-byte half of the key is transformed independently (ECB), so the rounds
+    for one half can be expressed as a CBC encryption of zero-blocks using the half
+    as IV: every ciphertext block is E(previous block), and the last block is
+    the half encrypted `rounds` times.  The zero-blocks are fed in chunks of
+    :data:`TRANSFORM_CHUNK_BLOCKS` so that memory stays bounded for large round counts.
+    
+    :param startkey: The 32-byte (composite) master key.
+    :param seed_key: The 32-byte transform seed from the header.
+    :param rounds: The number of transformation rounds.
+    :returns: The 32-byte key after `rounds` encryptions.
+    :rtype: bytes
+    """
+    if rounds == 0:
+        return startkey
+    
+    bs = AES.block_size
+    full_chunks, remainder = divmod(rounds, TRANSFORM_CHUNK_BLOCKS)
+    chunk = b'\0' * (bs * min(rounds, TRANSFORM_CHUNK_BLOCKS))
+    
+    transformed = []
+    for half in (startkey[:bs], startkey[bs:]):
+        # The CBC cipher object keeps chaining state across encrypt() calls.
+        aes = AES.new(seed_key, AES.MODE_CBC, half)
+        block = half
+        for _i in range(full_chunks):
+            block = aes.encrypt(chunk)[-bs:]
+        if remainder:
+            block = aes.encrypt(chunk[:bs * remainder])[-bs:]
+        transformed.append(block)
+    
+    return b''.join(transformed)
+
+# The available transform backends in order of preference (fastest first).
+TRANSFORM_BACKENDS = (
+    ('cbc', transform_rounds_cbc),
+    ('python', transform_rounds_python),
+)
+
+_transform_backend = None
+
+def get_transform_backend():
+    """
+    Returns the fastest working key transformation backend.
+    
+    Each backend is verified against the reference implementation once (the first
+    time this is called); backends that fail (or produce different output) are skipped.
+    
+    :returns: A (name, function) tuple.
+    :rtype: tuple
+    """
+    global _transform_backend
+    if _transform_backend is None:
+        startkey = b'\x01' * 32
+        seed_key = b'\x02' * 32
+        expected = transform_rounds_python(startkey, seed_key, 3)
+        for (name, func) in TRANSFORM_BACKENDS:
+            try:
+                if func(startkey, seed_key, 3) == expected:
+                    _transform_backend = (name, func)
+                    break
+            except Exception:
+                logging.getLogger(__name__).debug("Transform backend {0} unavailable.".format(name), exc_info=True)
+        else:
+            _transform_backend = ('python', transform_rounds_python)
+    return _transform_backend
+
+def transform_key(startkey, seed_key, seed_rand, rounds, backend=None):
+    """
+    This method creates the key to decrypt the database.
+    
+    :param backend: Optional transform rounds function to use (e.g. :func:`transform_rounds_python`);
+                    by default the fastest available backend is used (see :func:`get_transform_backend`).
+    """
+    masterkey = transform_master_key(startkey, seed_key=seed_key, rounds=rounds, backend=backend)
+    return finalize_key(masterkey, seed_rand=seed_rand)
+
+def transform_master_key(startkey, seed_key, rounds, backend=None):
+    """
+    Runs the transformation rounds on the master key and hashes the result.
+    
+    :param backend: Optional transform rounds function to use (see :func:`transform_key`).
+    :returns: The transformed master key.
+    :rtype: bytes
+    """
+    if backend is None:
+        (_name, backend) = get_transform_backend()
+    
+    masterkey = backend(startkey, seed_key, rounds)
 
     # Finally, hash it again...
-    masterkey = hashlib.sha256(masterkey).digest()
+    return hashlib.sha256(masterkey).digest()
+
+def finalize_key(transformed_key, seed_rand):
+    """
+    Creates the final (encryption) key from a transformed master key and the random seed.
+    
+    :rtype: bytes
+    """
     # ...and hash the result together with the randomseed
-    return hashlib.sha256(seed_rand + masterkey).digest()    
+    return hashlib.sha256(seed_rand + transformed_key).digest()
+
+def calibrate_rounds(target_seconds=1.0, backend=None, sample_seconds=0.05, timer=None):
+    """
+    Returns the number of key transformation rounds that take about target_seconds on this host.
+    
+    The key transformation is timed with an increasing number of rounds until a run takes
+    at least sample_seconds (or target_seconds if less); the result is extrapolated from that run.
+    
+    :param target_seconds: The time the key transformation should take.
+    :type target_seconds: float
+    :param backend: Optional transform rounds function (see :func:`transform_key`).
+    :param sample_seconds: The minimum duration of the timed run.
+    :type sample_seconds: float
+    :param timer: Optional timer function (for testing).
+    :rtype: int
+    """
+    if target_seconds <= 0:
+        raise ValueError("Target time must be positive: {0!r}".format(target_seconds))
+    if timer is None:
+        timer = getattr(time, 'perf_counter', time.time)
+    startkey = b'\x01' * 32
+    seed_key = b'\x02' * 32
+    seed_rand = b'\x03' * 16
+    sample_seconds = min(sample_seconds, target_seconds)
+    
+    rounds = 1000
+    while True:
+        start = timer()
+        transform_key(startkey, seed_key=seed_key, seed_rand=seed_rand, rounds=rounds, backend=backend)
+        elapsed = timer() - start
+        if elapsed >= sample_seconds or rounds >= const.DB_MAX_KEY_ENC_ROUNDS:
+            break
+        rounds = min(rounds * 4, const.DB_MAX_KEY_ENC_ROUNDS)
+    
+    calibrated = int(rounds * target_seconds / max(elapsed, 1e-9))
+    return max(1, min(calibrated, const.DB_MAX_KEY_ENC_ROUNDS))
+
+class KeyCache(object):
+    """
+    A bounded in-process cache of derived (final) keys.
+    
+    Entries are looked up by the master key, transform seed, random seed and number
+    of rounds; the cache only stores a SHA-256 digest of these inputs, not the master
+    key itself.  The least-recently-used entry is evicted when the cache is full and
+    entries older than `ttl` seconds are discarded on access.  Evicted keys are
+    overwritten in memory (as far as python allows).
+    
+    :ivar maxsize: The maximum number of keys to keep.
+    :ivar ttl: The maximum age (in seconds) of cached keys (None for no expiry).
+    """
+    
+    def __init__(self, maxsize=32, ttl=None, timer=time.time):
+        """
+        :param maxsize: The maximum number of keys to keep.
+        :type maxsize: int
+        :param ttl: The maximum age (in seconds) of cached keys (None for no expiry).
+        :type ttl: float
+        :param timer: The function used to get current time (mainly for testing).
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._entries = OrderedDict() # lookup digest -> (timestamp, bytearray key)
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    @staticmethod
+    def _lookup_key(masterkey, seed_key, seed_rand, rounds):
+        sha = hashlib.sha256()
+        sha.update(masterkey)
+        sha.update(seed_key)
+        sha.update(seed_rand)
+        sha.update(struct.pack('<L', rounds))
+        return sha.digest()
+    
+    @staticmethod
+    def _wipe(value):
+        for i in range(len(value)):
+            value[i] = 0
+    
+    def get(self, masterkey, seed_key, seed_rand, rounds):
+        """
+        Returns the cached final key for specified inputs or None if not cached (or expired).
+        
+        :rtype: bytes
+        """
+        lookup = self._lookup_key(masterkey, seed_key, seed_rand, rounds)
+        with self._lock:
+            try:
+                (timestamp, value) = self._entries.pop(lookup)
+            except KeyError:
+                return None
+            if self.ttl is not None and self.timer() - timestamp > self.ttl:
+                self._wipe(value)
+                return None
+            self._entries[lookup] = (timestamp, value) # re-insert as most recently used
+            return bytes(value)
+    
+    def put(self, masterkey, seed_key, seed_rand, rounds, final_key):
+        """
+        Stores the final key for specified inputs, evicting least-recently-used keys if necessary.
+        """
+        lookup = self._lookup_key(masterkey, seed_key, seed_rand, rounds)
+        with self._lock:
+            if lookup in self._entries:
+                self._wipe(self._entries.pop(lookup)[1])
+            while len(self._entries) >= self.maxsize:
+                (_lookup, (_timestamp, value)) = self._entries.popitem(last=False)
+                self._wipe(value)
+            self._entries[lookup] = (self.timer(), bytearray(final_key))
+    
+    def clear(self):
+        """
+        Removes (and wipes) all cached keys.
+        """
+        with self._lock:
+            for (_timestamp, value) in self._entries.values():
+                self._wipe(value)
+            self._entries.clear()
+
+class IdAllocator(object):
+    """
+    Allocates numeric ids in increasing order; released ids are handed out again
+    (lowest first) before new ids.
+    
+    :ivar next_id: The next (never allocated) id.
+    """
+    
+    def __init__(self, next_id=1):
+        self.next_id = next_id
+        self._free = [] # heap of released ids
+    
+    def reset(self, max_id=0):
+        """
+        Resets the allocator so that the next id is one above specified max id.
+        """
+        self.next_id = max_id + 1
+        self._free = []
+    
+    def allocate(self):
+        """
+        Returns a new id.
+        
+        :rtype: int
+        """
+        if self._free:
+            return heapq.heappop(self._free)
+        allocated = self.next_id
+        self.next_id += 1
+        return allocated
+    
+    def release(self, id):
+        """
+        Marks the id as no longer in use, so that it can be allocated again.
+        """
+        if id < self.next_id:
+            heapq.heappush(self._free, id)
 
 def decrypt_aes_cbc(ciphertext, key, iv):
     """
     This method decrypts contents and strips padding.
     
+    :param ciphertext: The encrypted content; besides bytes, any object supporting the buffer
+                       protocol (bytearray, memoryview, mmap, ...) is accepted without copying
+                       (see :func:`buffer_view`).
     :rtype: bytes
     """
     if not isinstance(ciphertext, bytes):
-        raise TypeError("content to decrypt must by bytes.")
+        try:
+            ciphertext = buffer_view(ciphertext)
+        except TypeError:
+            raise TypeError("content to decrypt must by bytes (or support the buffer protocol).")
     
     # Just decrypt the content with the created key
     aes = AES.new(key, AES.MODE_CBC, iv)
@@ -121,6 +458,51 @@ def decrypt_aes_cbc(ciphertext, key, iv):
     decrypted_content = decrypted_content[:len(decrypted_content) - padding]
     return decrypted_content
 
+def final_padding_valid(ciphertext, key, iv):
+    """
+    Decrypts only the final block of AES-CBC encrypted content and checks its (PKCS#7) padding.
+    
+    The previous ciphertext block (or the IV for single-block content) serves as IV for the
+    final block.  Decrypting with a wrong key yields valid padding with a probability of
+    roughly 1/256, so this rejects most wrong keys without decrypting all content.
+    
+    :param ciphertext: The encrypted content (bytes or an object supporting slicing, e.g. a buffer/mmap).
+    :returns: False if the padding is invalid (True if it is valid or the content length is
+              not a positive multiple of the block size, which decryption will report).
+    :rtype: bool
+    """
+    length = len(ciphertext)
+    if length == 0 or length % 16:
+        return True
+    if length > 16:
+        iv = bytes(ciphertext[length - 32:length - 16])
+    last = AES.new(key, AES.MODE_CBC, iv).decrypt(bytes(ciphertext[length - 16:]))
+    padding = ord(last[15:16])
+    return 1 <= padding <= 16 and last[16 - padding:] == last[15:16] * padding
+
+def buffer_view(data, offset=0):
+    """
+    Returns a read-only view of data (starting at offset) that can be passed to the cipher
+    without copying the data.
+    
+    :param data: Object supporting the buffer protocol (bytes, bytearray, mmap, ...).
+    :param offset: The offset of the view in data.
+    :type offset: int
+    :raises: TypeError - If data does not support the buffer protocol.
+    """
+    if isinstance(data, memoryview):
+        # (Python 2 memoryview objects do not support the buffer() interface.)
+        view = data[offset:]
+        try:
+            buffer
+        except NameError:
+            return view
+        return view.tobytes()
+    try:
+        return buffer(data, offset)
+    except NameError: # Python 3
+        return memoryview(data)[offset:]
+
 def encrypt_aes_cbc(cleartext, key, iv):
     """
     This method encrypts the content.
@@ -139,9 +521,160 @@ def encrypt_aes_cbc(cleartext, key, iv):
     cleartext += chr(padding).encode('utf-8') * padding # the encode() is for py3k compat
     return aes.encrypt(cleartext)
 
+class CbcEncryptor(object):
+    """
+    Incremental AES-CBC encryption with PKCS#7 padding (same output as :func:`encrypt_aes_cbc`
+    for the concatenated input).
+    """
+    
+    def __init__(self, key, iv):
+        self._aes = AES.new(key, AES.MODE_CBC, iv)
+        self._pending = b''
+    
+    def update(self, data):
+        """
+        Encrypts as many complete blocks as are available, keeping the remainder for the next call.
+        
+        :rtype: bytes
+        """
+        if self._pending:
+            data = self._pending + data
+        complete = len(data) - (len(data) % AES.block_size)
+        self._pending = data[complete:]
+        if not complete:
+            return b''
+        return self._aes.encrypt(data[:complete])
+    
+    def finalize(self):
+        """
+        Pads and encrypts the remaining data.
+        
+        :rtype: bytes
+        """
+        padding = AES.block_size - len(self._pending)
+        last = self._pending + struct.pack('B', padding) * padding
+        self._pending = b''
+        return self._aes.encrypt(last)
+
+class CbcDecryptor(object):
+    """
+    Incremental AES-CBC decryption that strips the padding of the final block (same output
+    as :func:`decrypt_aes_cbc` for the concatenated input).
+    
+    The last decrypted block is held back until :meth:`finalize`, since it contains the padding.
+    """
+    
+    def __init__(self, key, iv):
+        self._aes = AES.new(key, AES.MODE_CBC, iv)
+        self._pending = b''
+        self._last = b''
+    
+    def update(self, data):
+        """
+        Decrypts the complete blocks available (except the last one).
+        
+        :rtype: bytes
+        """
+        if self._pending:
+            data = self._pending + data
+        complete = len(data) - (len(data) % AES.block_size)
+        self._pending = data[complete:]
+        if not complete:
+            return b''
+        decrypted = self._last + self._aes.decrypt(data[:complete])
+        self._last = decrypted[-AES.block_size:]
+        return decrypted[:-AES.block_size]
+    
+    def finalize(self):
+        """
+        Returns the last block with padding removed.
+        
+        :rtype: bytes
+        :raises: :class:`keepassdb.exc.IncorrectKey` - If the ciphertext (length or padding) is invalid.
+        """
+        if self._pending:
+            raise exc.IncorrectKey("Encrypted content length is not a multiple of the block size.")
+        last = self._last
+        self._last = b''
+        if not last:
+            return b''
+        padding = ord(last[-1:])
+        if padding > AES.block_size:
+            raise exc.IncorrectKey("Decryption failed! The key is wrong or the file is damaged.")
+        return last[:len(last) - padding]
+
+class Clock(object):
+    """
+    The source of the created/modified/accessed timestamps set by the model.
+    
+    Timestamps have second precision (like the database format).  Use :meth:`batch` to
+    give all changes in a block of code the same timestamp and :meth:`frozen` to pin
+    the time (e.g. for tests).
+    
+    :ivar source: The function returning the current time (default: `datetime.now`).
+    """
+    
+    def __init__(self, source=None):
+        """
+        :param source: Optional function returning the current (naive) datetime.
+        :type source: callable
+        """
+        if source is None:
+            source = datetime.now
+        self.source = source
+        self._local = threading.local()
+    
+    def now(self):
+        """
+        Returns the current time (w/o microseconds) or the timestamp of the active batch.
+        
+        :rtype: :class:`datetime.datetime`
+        """
+        fixed = getattr(self._local, 'fixed', None)
+        if fixed is not None:
+            return fixed
+        return self.source().replace(microsecond=0)
+    
+    @contextmanager
+    def batch(self):
+        """
+        Context manager that uses a single timestamp for everything done in the block
+        (in the current thread).  Nested batches share the outer timestamp.
+        
+        :returns: The timestamp of the batch.
+        """
+        fixed = getattr(self._local, 'fixed', None)
+        if fixed is not None:
+            yield fixed
+            return
+        self._local.fixed = fixed = self.source().replace(microsecond=0)
+        try:
+            yield fixed
+        finally:
+            self._local.fixed = None
+    
+    @contextmanager
+    def frozen(self, value):
+        """
+        Context manager that pins the time to specified value (in the current thread).
+        
+        :type value: :class:`datetime.datetime`
+        """
+        previous = getattr(self._local, 'fixed', None)
+        self._local.fixed = value.replace(microsecond=0)
+        try:
+            yield self._local.fixed
+        finally:
+            self._local.fixed = previous
+
+# The clock used by :func:`now` (replace its source to plug in a different clock).
+clock = Clock()
+
 def now():
     """
     Save some typing by providing a datetime.now() object w/o the microsecond precision.
+    
+    Uses the module :data:`clock` (so honors batches and frozen time).
     """
-    return datetime.now().replace(microsecond=0)
+    return clock.now()
     
\ No newline at end of file